@@ -0,0 +1,367 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Columnar inventory of the objects, written by '--act stat'.
+
+Each worker process writes its own directory under the inventory directory,
+with one file per column:
+
+    bytes           int64, little endian
+    last_modified   float64, little endian, unix timestamp
+    flags           uint8, FLAG_* bits
+    tenant          int32, index in the 'tenants' list of meta.json
+    container       int32, index in the 'containers' list of meta.json
+    name            UTF-8 object names, each one ended by a NUL byte
+    hash            etags, each one ended by a NUL byte
+
+meta.json gives the number of rows written so far, so an inventory is
+usable even if the run was killed. run.json in the inventory directory gives
+the id of the last run, the directories of workers stamped with another run
+id are left from an earlier run and ignored. Writing only needs the standard
+library, the analysis needs NumPy.
+"""
+
+import bisect
+import json
+import os
+import struct
+import uuid
+
+import progress
+
+# The object is an S3 multi-part upload (from the listing hash).
+FLAG_MULTIPART = 1
+# The object is a dynamic large object manifest (only if FLAG_HEADERS).
+FLAG_DLO = 2
+# The object is a static large object manifest (only if FLAG_HEADERS).
+FLAG_SLO = 4
+# The headers of the object were stat'ed, so FLAG_DLO/FLAG_SLO are known.
+FLAG_HEADERS = 8
+
+# (file name, struct format, numpy dtype) of the fixed size columns.
+COLUMNS = (
+    ('bytes', 'q', '<i8'),
+    ('last_modified', 'd', '<f8'),
+    ('flags', 'B', 'u1'),
+    ('tenant', 'i', '<i4'),
+    ('container', 'i', '<i4'),
+)
+STRING_COLUMNS = ('name', 'hash')
+
+# Rows are written out every FLUSH_ROWS objects.
+FLUSH_ROWS = 10000
+
+# Upper bounds of the size histogram buckets.
+SIZE_BUCKETS = (0, 1024, 16 * 1024, 256 * 1024, 1024 ** 2, 16 * 1024 ** 2,
+                256 * 1024 ** 2, 1024 ** 3, 5 * 1024 ** 3)
+
+
+def header_flags(headers):
+    """FLAG_* bits known from the headers of an object."""
+    flags = FLAG_HEADERS
+    if headers.get('x-object-manifest'):
+        flags |= FLAG_DLO
+    if str(headers.get('x-static-large-object', '')).lower() == 'true':
+        flags |= FLAG_SLO
+    return flags
+
+
+def _write_json(path, value):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.rename(tmp_path, path)
+
+
+def start_run(path):
+    """Start a new inventory in path, return the id of the run.
+
+    The inventory of an earlier run in the same directory is replaced, even
+    if it had more workers than this one.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    run = uuid.uuid4().hex
+    _write_json(os.path.join(path, 'run.json'), {'run': run})
+    return run
+
+
+class InventoryWriter(object):
+    """Append objects to the columns of a worker, in batches."""
+
+    def __init__(self, path, run=None):
+        self.path = path
+        self.run = run
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for column in [c[0] for c in COLUMNS] + list(STRING_COLUMNS):
+            open(os.path.join(path, column), 'wb').close()
+
+        self.rows = 0
+        self.tenants = []
+        self.containers = []
+        self.tenant_index = {}
+        self.container_index = {}
+        self.pending = dict((c, []) for c in
+                            [c[0] for c in COLUMNS] + list(STRING_COLUMNS))
+        # The meta data of the last run is replaced at once.
+        self._write_meta()
+
+    def _index(self, tenant_name, container):
+        if tenant_name not in self.tenant_index:
+            self.tenant_index[tenant_name] = len(self.tenants)
+            self.tenants.append(tenant_name)
+        tenant = self.tenant_index[tenant_name]
+
+        key = (tenant, container)
+        if key not in self.container_index:
+            self.container_index[key] = len(self.containers)
+            self.containers.append([tenant, container])
+        return tenant, self.container_index[key]
+
+    def add(self, tenant_name, container, name, bytes, hash, last_modified,
+            flags=0):
+        tenant, container = self._index(tenant_name, container)
+        for column, value in (('bytes', bytes),
+                              ('last_modified', last_modified),
+                              ('flags', flags), ('tenant', tenant),
+                              ('container', container), ('name', name),
+                              ('hash', hash)):
+            self.pending[column].append(value)
+
+        if len(self.pending['bytes']) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        count = len(self.pending['bytes'])
+        if not count:
+            return
+
+        for column, fmt, dtype in COLUMNS:
+            with open(os.path.join(self.path, column), 'ab') as f:
+                f.write(struct.pack('<%d%s' % (count, fmt),
+                                    *self.pending[column]))
+        for column in STRING_COLUMNS:
+            with open(os.path.join(self.path, column), 'ab') as f:
+                f.write(b''.join(v.encode('utf-8') + b'\0'
+                                 for v in self.pending[column]))
+            self.pending[column] = []
+        for column, fmt, dtype in COLUMNS:
+            self.pending[column] = []
+
+        self.rows += count
+        self._write_meta()
+
+    def _write_meta(self):
+        _write_json(os.path.join(self.path, 'meta.json'),
+                    {'rows': self.rows, 'tenants': self.tenants,
+                     'containers': self.containers, 'run': self.run})
+
+    def close(self):
+        self.flush()
+        self._write_meta()
+
+
+class StringColumn(object):
+    """Strings of a column, kept on disk and decoded when looked up.
+
+    Inventories of big clusters have far too many object names to load them
+    all as Python strings, only the few which are printed are decoded.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.offsets = [0]
+
+    def add(self, np, path, rows):
+        """Add the first rows strings of the column file path."""
+        if os.path.getsize(path):
+            data = np.memmap(path, dtype='u1', mode='r')
+        else:
+            data = np.zeros(0, dtype='u1')
+        ends = np.flatnonzero(data == 0)[:rows]
+        starts = np.concatenate(([0], ends[:-1] + 1))[:len(ends)]
+        self.parts.append((data, starts, ends))
+        self.offsets.append(self.offsets[-1] + len(ends))
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, index):
+        index = int(index)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        part = bisect.bisect_right(self.offsets, index) - 1
+        data, starts, ends = self.parts[part]
+        row = index - self.offsets[part]
+        return data[starts[row]:ends[row]].tobytes().decode('utf-8')
+
+
+def _load_worker(np, path, meta, strings):
+    rows = meta['rows']
+
+    columns = {}
+    for column, fmt, dtype in COLUMNS:
+        columns[column] = np.fromfile(os.path.join(path, column),
+                                      dtype=dtype, count=rows)
+    for column in STRING_COLUMNS:
+        strings[column].add(np, os.path.join(path, column), rows)
+    return columns
+
+
+def load(path):
+    """Load the inventory of all the workers, as a dict of NumPy arrays.
+
+    The tenant and container columns are made indexes in the 'tenants' and
+    'containers' lists of the whole inventory. The name and hash columns are
+    StringColumn, not arrays. Only the workers of the last run are loaded.
+    """
+    import numpy as np
+
+    run = None
+    if os.path.exists(os.path.join(path, 'run.json')):
+        with open(os.path.join(path, 'run.json')) as f:
+            run = json.load(f)['run']
+
+    tenants = []
+    tenant_index = {}
+    containers = []
+    parts = []
+    strings = dict((column, StringColumn()) for column in STRING_COLUMNS)
+
+    for entry in sorted(os.listdir(path)):
+        worker_path = os.path.join(path, entry)
+        if not os.path.exists(os.path.join(worker_path, 'meta.json')):
+            continue
+        with open(os.path.join(worker_path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('run') != run:
+            continue
+        columns = _load_worker(np, worker_path, meta, strings)
+
+        tenant_map = []
+        for name in meta['tenants']:
+            if name not in tenant_index:
+                tenant_index[name] = len(tenants)
+                tenants.append(name)
+            tenant_map.append(tenant_index[name])
+        tenant_map = np.array(tenant_map or [0], dtype='<i4')
+
+        container_map = np.arange(len(containers),
+                                  len(containers) + len(meta['containers']),
+                                  dtype='<i4')
+        containers.extend((tenants[tenant_map[t]], name)
+                          for t, name in meta['containers'])
+
+        columns['tenant'] = tenant_map[columns['tenant']]
+        columns['container'] = (container_map[columns['container']]
+                                if len(container_map)
+                                else columns['container'])
+        parts.append(columns)
+
+    inventory = {'tenants': tenants, 'containers': containers}
+    for column, fmt, dtype in COLUMNS:
+        inventory[column] = np.concatenate(
+            [p[column] for p in parts] or [np.zeros(0, dtype=dtype)])
+    inventory.update(strings)
+    return inventory
+
+
+def size_histogram(inventory):
+    """Objects and bytes per size bucket, as a list of (bound, objects,
+    bytes), the last bound being None for the objects over 5G."""
+    import numpy as np
+
+    sizes = inventory['bytes']
+    buckets = np.searchsorted(np.array(SIZE_BUCKETS), sizes, side='left')
+    counts = np.bincount(buckets, minlength=len(SIZE_BUCKETS) + 1)
+    bytes = np.bincount(buckets, weights=sizes,
+                        minlength=len(SIZE_BUCKETS) + 1)
+    bounds = list(SIZE_BUCKETS) + [None]
+    return list(zip(bounds, counts.tolist(), bytes.astype('i8').tolist()))
+
+
+def tenant_distribution(inventory, percentiles=(50, 90, 99)):
+    """Objects, bytes, size percentiles and largest object of each tenant.
+
+    Return a list of (tenant, objects, bytes, [percentiles...], max), the
+    tenants with the most bytes first.
+    """
+    import numpy as np
+
+    tenant = inventory['tenant']
+    sizes = inventory['bytes']
+    if not len(sizes):
+        return []
+
+    # Sort the sizes by tenant, then each tenant's sizes are a slice.
+    order = np.lexsort((sizes, tenant))
+    sorted_sizes = sizes[order]
+    counts = np.bincount(tenant, minlength=len(inventory['tenants']))
+    totals = np.bincount(tenant, weights=sizes,
+                         minlength=len(inventory['tenants']))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+
+    values = []
+    for p in percentiles:
+        index = starts + np.floor((counts - 1) * p / 100.0).astype(int)
+        values.append(np.where(present, sorted_sizes[np.where(
+            present, index, 0)], 0))
+    maximum = np.where(present, sorted_sizes[np.where(
+        present, starts + counts - 1, 0)], 0)
+
+    result = []
+    for i in np.argsort(-totals, kind='mergesort'):
+        if present[i]:
+            result.append((inventory['tenants'][i], int(counts[i]),
+                           int(totals[i]), [int(v[i]) for v in values],
+                           int(maximum[i])))
+    return result
+
+
+def top_objects(inventory, count=10):
+    """The largest objects, as (tenant, container, name, bytes)."""
+    import numpy as np
+
+    sizes = inventory['bytes']
+    count = min(count, len(sizes))
+    if not count:
+        return []
+
+    top = np.argpartition(-sizes, count - 1)[:count]
+    top = top[np.argsort(-sizes[top], kind='mergesort')]
+    return [(inventory['containers'][inventory['container'][i]][0],
+             inventory['containers'][inventory['container'][i]][1],
+             inventory['name'][i], int(sizes[i])) for i in top]
+
+
+def project_time(inventory, bandwidth, overhead, workers=1,
+                 object_threads=10):
+    """Projected migration time in seconds, as (total, largest tenant).
+
+    The same forecast as '--act plan' of swift-migrate.py, from the objects
+    and bytes of each tenant in the inventory.
+    """
+    import numpy as np
+
+    tenants = len(inventory['tenants'])
+    objects = np.bincount(inventory['tenant'], minlength=tenants)
+    bytes = np.bincount(inventory['tenant'], weights=inventory['bytes'],
+                        minlength=tenants)
+    return progress.run_seconds(
+        progress.tenant_seconds(objects, bytes, bandwidth, overhead,
+                                object_threads=object_threads),
+        workers=workers)
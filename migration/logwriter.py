@@ -0,0 +1,141 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Output of the worker processes, as a stream of JSON lines.
+
+Each line is one JSON record with the time, worker, tenant, container (if
+any) and message. Records are buffered in memory and written out when the
+buffer is full or every few seconds, and the file is rotated when it grows
+over a given size, so the memory used stays bounded however big the tenant
+is, and the output is on disk if the process dies.
+"""
+
+import json
+import os
+import threading
+import time
+
+# Records are written out when this many bytes are buffered...
+BUFFER_SIZE = 64 * 1024
+# ...and at least every this many seconds.
+FLUSH_INTERVAL = 5
+
+
+class LogWriter(object):
+    """Buffered JSON lines writer with size based rotation.
+
+    When the file would grow over 'max_bytes', it is renamed to path.1 (and
+    path.1 to path.2, and so on, up to 'backups' files) and a new file is
+    started. A 'max_bytes' of 0 disables the rotation.
+    """
+
+    def __init__(self, path, max_bytes=0, backups=5,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.buffer = []
+        self.buffered = 0
+
+        # The output of a previous run is removed first.
+        for i in range(1, backups + 1):
+            if os.path.exists('%s.%s' % (path, i)):
+                os.remove('%s.%s' % (path, i))
+        self.file = open(path, 'w')
+        self.size = 0
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, message, **fields):
+        record = {'time': round(time.time(), 3), 'message': message}
+        record.update(fields)
+        line = json.dumps(record, sort_keys=True) + '\n'
+
+        with self.lock:
+            self.buffer.append(line)
+            self.buffered += len(line)
+            if self.buffered >= BUFFER_SIZE:
+                self._flush()
+
+    def bind(self, **fields):
+        """Get a log of records which all have the given fields."""
+        return _BoundLog(self, fields)
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists('%s.%s' % (self.path, i)):
+                os.rename('%s.%s' % (self.path, i),
+                          '%s.%s' % (self.path, i + 1))
+        if self.backups:
+            os.rename(self.path, '%s.1' % self.path)
+        self.file = open(self.path, 'w')
+        self.size = 0
+
+    def _flush(self):
+        for line in self.buffer:
+            if (self.max_bytes and self.size and
+                    self.size + len(line) > self.max_bytes):
+                self._rotate()
+            self.file.write(line)
+            self.size += len(line)
+        self.file.flush()
+        self.buffer = []
+        self.buffered = 0
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+
+class _BoundLog(object):
+    """Records of a writer sharing some fields, e.g. tenant and container.
+
+    It can be used in place of the list of output lines, with append() and
+    extend(). The lines given to extend() are written together.
+    """
+
+    def __init__(self, writer, fields):
+        self.writer = writer
+        self.fields = fields
+
+    def bind(self, **fields):
+        bound = dict(self.fields)
+        bound.update(fields)
+        return _BoundLog(self.writer, bound)
+
+    def append(self, line):
+        self.writer.write(line.strip(), **self.fields)
+
+    def extend(self, lines):
+        with self.writer.lock:
+            for line in lines:
+                self.writer.write(line.strip(), **self.fields)
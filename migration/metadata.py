@@ -0,0 +1,163 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Engines for the metadata requests: container listings and object HEADs.
+
+The 'service' engine goes through the service client, so the HEADs of a
+listing page are limited by its object_dd_threads pool. The 'pooled' engine
+has its own pool of threads, each with keep-alive connections to the storage
+hosts, so that hundreds of HEADs can be in flight. HEADs are pure latency,
+so many more of them can be in flight than transfers.
+
+Both engines give the results in the format of the service client.
+"""
+
+from concurrent import futures
+import threading
+
+from six.moves.urllib.parse import urlparse
+from swiftclient.command_helpers import stat_object
+from swiftclient.service import get_conn
+
+import util
+
+# Objects in each listing page requested by the pooled engine.
+LISTING_LIMIT = 10000
+
+
+class ServiceEngine(object):
+    """Listings and HEADs through the thread pools of the service client."""
+
+    def __init__(self, srvclient):
+        self.srvclient = srvclient
+
+    def list(self, container, marker=None):
+        if not marker:
+            return self.srvclient.list(container=container)
+
+        # SwiftService.list() ignores the marker before swiftclient 3.1.0,
+        # so the pages after the marker are listed with a connection of the
+        # service client.
+        return _list_pages(
+            lambda marker: util.call_with_connection(
+                self.srvclient, _list_page, container, marker),
+            marker)
+
+    def stat(self, container, names):
+        return self.srvclient.stat(container=container, objects=names)
+
+
+class MetadataPool(object):
+    """Threads with keep-alive connections, shared by the tenants of a worker.
+
+    Each thread keeps one connection per storage host, which is pointed to
+    the tenant of the service client the request is made for.
+    """
+
+    def __init__(self, concurrency, tokens=None):
+        self.executor = futures.ThreadPoolExecutor(concurrency)
+        self.local = threading.local()
+        self.tokens = tokens
+
+    def _connection(self, options):
+        conns = self.local.__dict__.setdefault('conns', {})
+        storage_url = options['os_storage_url']
+        token = options['os_auth_token']
+        key = urlparse(storage_url)[:2]
+
+        conn = conns.get(key)
+        if conn is None:
+            # The connection gets its own os_options, which are changed when
+            # switching tenant.
+            conn = conns[key] = get_conn(
+                dict(options, os_options=dict(options['os_options'])))
+            if self.tokens:
+                util.use_token_cache(conn, self.tokens)
+        elif (conn.url, conn.token) != (storage_url, token):
+            util.switch_connection(conn, options['os_tenant_name'],
+                                   storage_url, token)
+        return conn
+
+    def _call(self, options, fn, *args):
+        return fn(self._connection(options), *args)
+
+    def submit(self, options, fn, *args):
+        """Submit fn(conn, *args) with a connection for options."""
+        return self.executor.submit(self._call, options, fn, *args)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+def _head(conn, options, container, name):
+    try:
+        items, headers = stat_object(conn, options, container, name)
+    except Exception as e:
+        return {'success': False, 'object': name, 'error': e}
+    return {'success': True, 'object': name, 'items': items,
+            'headers': headers}
+
+
+def _list_page(conn, container, marker):
+    return conn.get_container(container, marker=marker,
+                              limit=LISTING_LIMIT)[1]
+
+
+def _list_pages(get_page, marker):
+    """Listing pages after marker, in the format of the service client."""
+    marker = marker or ''
+    while True:
+        try:
+            listing = get_page(marker)
+        except Exception as e:
+            yield {'success': False, 'error': e}
+            return
+
+        if not listing:
+            return
+        yield {'success': True, 'listing': listing}
+        marker = listing[-1]['name']
+
+
+class PooledEngine(object):
+    """Listings and HEADs through the threads of a MetadataPool."""
+
+    def __init__(self, srvclient, pool):
+        self.srvclient = srvclient
+        self.pool = pool
+
+    def list(self, container, marker=None):
+        return _list_pages(
+            lambda marker: self.pool.submit(
+                self.srvclient._options, _list_page, container,
+                marker).result(),
+            marker)
+
+    def stat(self, container, names):
+        """Stat objects, the results are given in the order of names.
+
+        Like the service client, all the HEADs are submitted before the
+        results are iterated over.
+        """
+        options = self.srvclient._options
+        jobs = [self.pool.submit(options, _head, options, container, name)
+                for name in names]
+        return (job.result() for job in jobs)
+
+
+def get_engine(name, srvclient, pool=None):
+    if name == 'pooled':
+        return PooledEngine(srvclient, pool)
+    return ServiceEngine(srvclient)
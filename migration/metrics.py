@@ -0,0 +1,286 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Timers and counters of the migration phases.
+
+Each process records its own metrics in the module registry. The workers
+send snapshots of their registry to the main process, which merges them and
+writes them to a Prometheus node-exporter textfile.
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+from six.moves import queue
+
+PREFIX = 'swift_migrate'
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+           120, 300, 600, 1800, 3600)
+
+HELP = {
+    'phase_seconds': 'Time spent in each phase of the migration.',
+    'bytes_total': 'Bytes transferred in each phase of the migration.',
+    'objects_total': 'Objects handled, by result.',
+    'bytes_per_second': 'Bytes transferred per second in each phase, over '
+                        'the last export interval.',
+}
+
+
+class Registry(object):
+    """Counters and latency histograms, keyed by (name, label, value)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        # key: [bucket counts..., sum, count]
+        self.histograms = {}
+
+    def count(self, name, value=1, **labels):
+        key = (name,) + tuple(sorted(labels.items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name,) + tuple(sorted(labels.items()))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return (dict(self.counters),
+                    dict((k, list(v)) for k, v in self.histograms.items()))
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+REGISTRY = Registry()
+
+
+def count(name, value=1, **labels):
+    REGISTRY.count(name, value, **labels)
+
+
+def observe(phase, seconds):
+    REGISTRY.observe('phase_seconds', seconds, phase=phase)
+
+
+@contextlib.contextmanager
+def timer(phase):
+    """Time the block as one occurrence of phase."""
+    started = time.time()
+    try:
+        yield
+    finally:
+        observe(phase, time.time() - started)
+
+
+def timed_iter(phase, iterable):
+    """Time getting each item of iterable as one occurrence of phase."""
+    iterator = iter(iterable)
+    while True:
+        with timer(phase):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def merge(snapshots):
+    """Sum up the snapshots of several processes."""
+    counters = {}
+    histograms = {}
+
+    for worker_counters, worker_histograms in snapshots:
+        for key, value in worker_counters.items():
+            counters[key] = counters.get(key, 0) + value
+        for key, values in worker_histograms.items():
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+
+    return counters, histograms
+
+
+def _labels(key, **extra):
+    labels = list(key[1:]) + sorted(extra.items())
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                             for k, v in labels)
+
+
+def format_textfile(counters, histograms, rates):
+    """Format metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def _header(name, kind):
+        lines.append('# HELP %s_%s %s' % (PREFIX, name, HELP.get(name, name)))
+        lines.append('# TYPE %s_%s %s' % (PREFIX, name, kind))
+
+    for name in sorted(set(key[0] for key in counters)):
+        _header(name, 'counter')
+        for key in sorted(k for k in counters if k[0] == name):
+            lines.append('%s_%s%s %s' % (PREFIX, name, _labels(key),
+                                         counters[key]))
+
+    for name in sorted(set(key[0] for key in histograms)):
+        _header(name, 'histogram')
+        for key in sorted(k for k in histograms if k[0] == name):
+            values = histograms[key]
+            for bound, value in zip(BUCKETS, values):
+                lines.append('%s_%s_bucket%s %s' % (
+                    PREFIX, name, _labels(key, le=bound), value))
+            lines.append('%s_%s_bucket%s %s' % (
+                PREFIX, name, _labels(key, le='+Inf'), values[-1]))
+            lines.append('%s_%s_sum%s %.6f' % (PREFIX, name, _labels(key),
+                                               values[-2]))
+            lines.append('%s_%s_count%s %s' % (PREFIX, name, _labels(key),
+                                                values[-1]))
+
+    if rates:
+        _header('bytes_per_second', 'gauge')
+        for key in sorted(rates):
+            lines.append('%s_bytes_per_second%s %.3f' % (
+                PREFIX, _labels(key), rates[key]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def read_textfile(path):
+    """Read the samples of a textfile, as {(name, labels): value}.
+
+    'labels' is the sorted tuple of (label, value), e.g. the metrics of a
+    previous run can be read back from its --metrics-file.
+    """
+    samples = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            name_labels, value = line.rsplit(' ', 1)
+            labels = ()
+            if '{' in name_labels:
+                name, label_text = name_labels[:-1].split('{', 1)
+                labels = tuple(sorted(
+                    (k, v.strip('"')) for k, v in
+                    (pair.split('=', 1) for pair in label_text.split(',')
+                     if pair)))
+            else:
+                name = name_labels
+            samples[(name, labels)] = float(value)
+
+    return samples
+
+
+class Reporter(object):
+    """Send snapshots of the registry of a worker to the main process."""
+
+    def __init__(self, id, snapshot_queue, interval):
+        self.id = id
+        self.queue = snapshot_queue
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.queue.put((self.id, REGISTRY.snapshot()))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.queue.put((self.id, REGISTRY.snapshot()))
+
+
+class Exporter(object):
+    """Merge the snapshots of the workers and write the textfile.
+
+    The textfile is written every 'interval' seconds, to a temporary file
+    renamed over it so that node-exporter never reads a partial file.
+    """
+
+    def __init__(self, path, snapshot_queue, interval):
+        self.path = path
+        self.queue = snapshot_queue
+        self.interval = interval
+        self.snapshots = {}
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _drain(self):
+        while True:
+            try:
+                id, snapshot = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.snapshots[id] = snapshot
+
+    def export(self):
+        self._drain()
+        # The main process records metrics too, e.g. the tenant sizing.
+        counters, histograms = merge(list(self.snapshots.values()) +
+                                     [REGISTRY.snapshot()])
+
+        now = time.time()
+        bytes_counters = dict((k, v) for k, v in counters.items()
+                              if k[0] == 'bytes_total')
+        rates = {}
+        if self.last:
+            last_time, last_bytes = self.last
+            elapsed = max(now - last_time, 1e-6)
+            for key, value in bytes_counters.items():
+                rates[key] = (value - last_bytes.get(key, 0)) / elapsed
+        self.last = (now, bytes_counters)
+
+        tmp_path = '%s.%s' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(format_textfile(counters, histograms, rates))
+        os.rename(tmp_path, self.path)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.export()
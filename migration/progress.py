@@ -0,0 +1,307 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Live progress of the migration across the worker processes.
+
+Each worker reports the progress of its current tenant (objects and bytes
+handled, out of the totals from the account stats) to the main process,
+which prints the progress, throughput and ETA of the tenants and of the
+whole run periodically.
+
+The forecast of the migration time, before it is started, is also here,
+with the options it takes.
+"""
+
+import argparse
+import threading
+import time
+
+from six.moves import queue
+
+# Smoothing of the throughput used to estimate the remaining time.
+RATE_SMOOTHING = 0.3
+
+
+def format_bytes(bytes):
+    for unit in ('B', 'K', 'M', 'G', 'T'):
+        if abs(bytes) < 1024 or unit == 'T':
+            break
+        bytes /= 1024.0
+    return '%.1f%s' % (bytes, unit)
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return 'unknown'
+
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return '%dd %02d:%02d:%02d' % (days, hours, minutes, seconds)
+    return '%02d:%02d:%02d' % (hours, minutes, seconds)
+
+
+def positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError('must be greater than 0')
+    return value
+
+
+def non_negative_float(value):
+    value = float(value)
+    if value < 0:
+        raise argparse.ArgumentTypeError('must not be negative')
+    return value
+
+
+def positive_int(value):
+    value = int(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError('must be greater than 0')
+    return value
+
+
+def tenant_seconds(objects, bytes, bandwidth, overhead, object_threads=1):
+    """Forecast time to migrate objects of a tenant, of bytes in total.
+
+    Each object takes 'overhead' seconds plus its size over 'bandwidth'
+    (bytes per second of one transfer), and 'object_threads' objects are
+    transferred at the same time. Also works on NumPy arrays of tenants.
+    """
+    return (objects * overhead + bytes / float(bandwidth)) / object_threads
+
+
+def run_seconds(tenant_seconds, workers=1):
+    """Forecast time of a run, as (total, largest tenant), in seconds.
+
+    The tenants are spread over 'workers' processes, and the run takes at
+    least the time of the largest tenant.
+    """
+    if not len(tenant_seconds):
+        return 0.0, 0.0
+
+    largest = float(max(tenant_seconds))
+    return max(float(sum(tenant_seconds)) / workers, largest), largest
+
+
+class Tracker(object):
+    """Progress of the tenant being migrated by a worker.
+
+    The counters are kept locally and sent to the main process every
+    'interval' seconds, and when a tenant starts or finishes. Without a
+    queue, nothing is reported.
+    """
+
+    def __init__(self, id, progress_queue=None, interval=60):
+        self.id = id
+        self.queue = progress_queue
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.tenant = None
+        # [objects handled, bytes handled, objects moved, bytes moved]
+        self.counts = [0, 0, 0, 0]
+        self.stopped = threading.Event()
+        self.thread = None
+
+        if self.queue:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _send(self, kind, *args):
+        if self.queue:
+            self.queue.put((kind, self.id) + args)
+
+    def _update(self):
+        with self.lock:
+            if self.tenant:
+                self._send('update', self.tenant, list(self.counts))
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._update()
+
+    def start_tenant(self, tenant_name, objects, bytes):
+        with self.lock:
+            self.tenant = tenant_name
+            self.counts = [0, 0, 0, 0]
+            self._send('start', tenant_name, objects, bytes)
+
+    def add(self, objects, bytes, moved=False):
+        """Count objects handled, whether they are moved or not."""
+        with self.lock:
+            self.counts[0] += objects
+            self.counts[1] += bytes
+            if moved:
+                self.counts[2] += objects
+                self.counts[3] += bytes
+
+    def finish_tenant(self):
+        with self.lock:
+            if self.tenant:
+                self._send('finish', self.tenant, list(self.counts))
+            self.tenant = None
+
+    def stop(self):
+        self.finish_tenant()
+        if self.thread:
+            self.stopped.set()
+            self.thread.join()
+
+
+class Monitor(object):
+    """Print the progress reported by the workers every 'interval' seconds.
+
+    'planned' gives the {tenant: (objects, bytes)} known before the tenants
+    are started, they are replaced by the account stats of the tenants when
+    the workers start them.
+    """
+
+    def __init__(self, progress_queue, interval, tenants, planned=None):
+        self.queue = progress_queue
+        self.interval = interval
+        self.tenants = tenants
+        self.planned = dict(planned or {})
+        self.progress = {}
+        self.started = time.time()
+        self.last = None
+        self.rate = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _drain(self):
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+            kind, id, tenant_name = message[:3]
+            if kind == 'start':
+                self.planned[tenant_name] = message[3:5]
+                self.progress[tenant_name] = {
+                    'worker': id, 'counts': [0, 0, 0, 0], 'done': False,
+                    'rate': None,
+                }
+            elif tenant_name in self.progress:
+                tenant = self.progress[tenant_name]
+                tenant['counts'] = message[3]
+                tenant['done'] = kind == 'finish'
+
+    def _totals(self):
+        planned = [0, 0]
+        counts = [0, 0, 0, 0]
+        for tenant_name in self.tenants:
+            objects, bytes = self.planned.get(tenant_name, (0, 0))
+            planned[0] += objects
+            planned[1] += bytes
+        for tenant in self.progress.values():
+            counts = [a + b for a, b in zip(counts, tenant['counts'])]
+        return planned, counts
+
+    @staticmethod
+    def _eta(planned, counts, rate):
+        """Remaining time from the handled bytes (or objects) rate."""
+        if planned[1]:
+            remaining, index = planned[1] - counts[1], 1
+        else:
+            remaining, index = planned[0] - counts[0], 0
+        if remaining <= 0:
+            return 0
+        if not rate or not rate[index]:
+            return None
+        return remaining / rate[index]
+
+    @staticmethod
+    def _smooth(rate, new):
+        if rate is None:
+            return new
+        return [r + RATE_SMOOTHING * (n - r) for r, n in zip(rate, new)]
+
+    def _percent(self, done, total):
+        return 100.0 * done / total if total else 100.0
+
+    def report(self):
+        self._drain()
+        now = time.time()
+        planned, counts = self._totals()
+
+        # Rates of [objects handled, bytes handled, bytes moved] per second.
+        if self.last:
+            last_time, last_counts, last_tenants = self.last
+            elapsed = max(now - last_time, 1e-6)
+            self.rate = self._smooth(
+                self.rate,
+                [(counts[i] - last_counts[i]) / elapsed for i in (0, 1, 3)])
+
+            for tenant_name, tenant in self.progress.items():
+                previous = last_tenants.get(tenant_name, [0, 0, 0, 0])
+                tenant['rate'] = self._smooth(
+                    tenant['rate'],
+                    [(tenant['counts'][i] - previous[i]) / elapsed
+                     for i in (0, 1, 3)])
+        self.last = (now, counts,
+                     dict((name, list(tenant['counts']))
+                          for name, tenant in self.progress.items()))
+
+        done = len([t for t in self.progress.values() if t['done']])
+        lines = [
+            '[progress] tenants: %s/%s done, objects: %s/%s (%.1f%%), '
+            'bytes: %s/%s (%.1f%%), moved: %s, %s/s, elapsed: %s, ETA: %s' % (
+                done, len(self.tenants), counts[0], planned[0],
+                self._percent(counts[0], planned[0]),
+                format_bytes(counts[1]), format_bytes(planned[1]),
+                self._percent(counts[1], planned[1]),
+                format_bytes(counts[3]),
+                format_bytes(self.rate[2] if self.rate else 0),
+                format_eta(now - self.started),
+                format_eta(self._eta(planned, counts, self.rate)))
+        ]
+
+        for tenant_name, tenant in sorted(self.progress.items()):
+            if tenant['done']:
+                continue
+
+            tenant_planned = self.planned.get(tenant_name, (0, 0))
+            tenant_counts = tenant['counts']
+            rate = tenant['rate']
+            lines.append(
+                '[progress]   [%02d] %s: objects: %s/%s, bytes: %s/%s '
+                '(%.1f%%), %s/s, ETA: %s' % (
+                    tenant['worker'], tenant_name, tenant_counts[0],
+                    tenant_planned[0], format_bytes(tenant_counts[1]),
+                    format_bytes(tenant_planned[1]),
+                    self._percent(tenant_counts[1], tenant_planned[1]),
+                    format_bytes(rate[2] if rate else 0),
+                    format_eta(self._eta(tenant_planned, tenant_counts,
+                                         rate))))
+
+        print('\n'.join(lines))
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report()
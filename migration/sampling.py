@@ -0,0 +1,157 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Estimates of object properties only known from a HEAD of the objects.
+
+The sizes and hashes of objects are in the container listings, but whether
+an object is a large object manifest and the size of its metadata are only
+in its headers. Instead of a HEAD of every object, a fraction of them is
+sampled and the properties of all the objects are estimated with 95%
+confidence intervals.
+"""
+
+import hashlib
+import math
+
+# z-score of the 95% confidence intervals.
+Z_95 = 1.96
+
+
+def is_sampled(container, name, rate):
+    """Whether the object is in a sample of about 'rate' of the objects.
+
+    The sample is picked from the hash of the object path, so that the same
+    objects are sampled again by later runs.
+    """
+    if rate >= 1:
+        return True
+    path = ('%s/%s' % (container, name)).encode('utf-8')
+    return int(hashlib.md5(path).hexdigest()[:8], 16) < rate * 0x100000000
+
+
+def metadata_size(headers):
+    """Size of the user metadata in headers, names and values."""
+    return sum(len(k) - len('x-object-meta-') + len(v)
+               for k, v in headers.items()
+               if k.lower().startswith('x-object-meta-'))
+
+
+def _correction(sampled, population):
+    """Finite population correction of the variance of a sample."""
+    if not population or population <= 1:
+        return 1.0
+    return max(0.0, float(population - sampled) / (population - 1))
+
+
+def proportion_interval(successes, sampled, population=None, z=Z_95):
+    """Wilson score interval of a proportion, as (low, high).
+
+    The finite population correction shrinks the interval down to the
+    proportion itself when all the objects are sampled.
+    """
+    if not sampled:
+        return 0.0, 1.0
+
+    p = float(successes) / sampled
+    correction = _correction(sampled, population)
+    if not correction:
+        return p, p
+    n = sampled / correction
+
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    spread = (z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) /
+              (1 + z * z / n))
+    return max(0.0, center - spread), min(1.0, center + spread)
+
+
+def mean_interval(total, total_sq, sampled, population=None, z=Z_95):
+    """Mean and normal confidence interval, as (mean, low, high)."""
+    if not sampled:
+        return 0.0, 0.0, 0.0
+
+    mean = float(total) / sampled
+    if sampled > 1:
+        variance = max(0.0, (total_sq - sampled * mean * mean) /
+                       (sampled - 1))
+    else:
+        variance = 0.0
+    spread = z * math.sqrt(variance / sampled *
+                           _correction(sampled, population))
+    return mean, max(0.0, mean - spread), mean + spread
+
+
+class Sample(object):
+    """Counters of the listed objects and of the sampled headers.
+
+    The counters are those of util.TenantStats, so the samples of tenants
+    processed by different workers can be summed up.
+    """
+
+    FIELDS = ('listed_objects', 'listed_multipart', 'sampled_objects',
+              'sampled_dlo', 'sampled_slo', 'sampled_meta_bytes',
+              'sampled_meta_bytes_sq')
+
+    def __init__(self, counts=None):
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        if counts:
+            for field in self.FIELDS:
+                self.counts[field] = counts.get(field, 0)
+
+    def add_listed(self, multipart=False):
+        self.counts['listed_objects'] += 1
+        if multipart:
+            self.counts['listed_multipart'] += 1
+
+    def add_headers(self, headers):
+        meta = metadata_size(headers)
+        self.counts['sampled_objects'] += 1
+        self.counts['sampled_meta_bytes'] += meta
+        self.counts['sampled_meta_bytes_sq'] += meta * meta
+        if headers.get('x-object-manifest'):
+            self.counts['sampled_dlo'] += 1
+        if str(headers.get('x-static-large-object', '')).lower() == 'true':
+            self.counts['sampled_slo'] += 1
+
+    def report(self):
+        """Lines describing the listed objects and the estimates."""
+        c = self.counts
+        listed = c['listed_objects']
+        sampled = c['sampled_objects']
+
+        lines = ['objects listed: %s, S3 multi-part: %s' % (
+            listed, c['listed_multipart'])]
+        if not sampled:
+            return lines
+
+        lines.append('objects sampled: %s (%.2f%%), estimates with 95%% '
+                     'confidence intervals:' % (
+                         sampled, 100.0 * sampled / max(listed, 1)))
+        for name, field in (('dynamic large objects', 'sampled_dlo'),
+                            ('static large objects', 'sampled_slo')):
+            low, high = proportion_interval(c[field], sampled, listed)
+            lines.append('  %s: %.2f%% [%.2f%%, %.2f%%], about %d [%d, %d]'
+                         % (name, 100.0 * c[field] / sampled, 100 * low,
+                            100 * high, round(float(c[field]) / sampled *
+                                              listed),
+                            math.floor(low * listed),
+                            math.ceil(high * listed)))
+
+        mean, low, high = mean_interval(c['sampled_meta_bytes'],
+                                        c['sampled_meta_bytes_sq'], sampled,
+                                        listed)
+        lines.append('  metadata bytes per object: %.1f [%.1f, %.1f], total '
+                     'about %d [%d, %d]' % (mean, low, high, mean * listed,
+                                            low * listed, high * listed))
+        return lines
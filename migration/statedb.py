@@ -0,0 +1,187 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sqlite3
+import threading
+import time
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS objects (
+        tenant TEXT NOT NULL,
+        container TEXT NOT NULL,
+        name TEXT NOT NULL,
+        etag TEXT,
+        bytes INTEGER,
+        last_modified TEXT,
+        result TEXT,
+        updated_at REAL,
+        PRIMARY KEY (tenant, container, name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS containers (
+        tenant TEXT NOT NULL,
+        container TEXT NOT NULL,
+        marker TEXT,
+        done INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant, container)
+    )""",
+    """CREATE TABLE IF NOT EXISTS retries (
+        tenant TEXT NOT NULL,
+        container TEXT NOT NULL,
+        name TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        updated_at REAL,
+        PRIMARY KEY (tenant, container, name)
+    )""",
+]
+
+
+class StateDB(object):
+    """Local state of the migration, kept in a SQLite database.
+
+    For each object, the source etag, size, last modified time (as they are in
+    the source container listing) and the migration result are recorded. For
+    each container, the listing marker up to which all the objects have been
+    handled is recorded, so that a killed run can be resumed. The objects
+    which failed to migrate are kept in a retry queue, until they are
+    migrated by a later run.
+
+    The database file can be shared by several worker processes, each of them
+    opens its own StateDB. Writes are buffered and committed in batches, reads
+    only see committed writes.
+    """
+
+    def __init__(self, path, batch_size=1000, flush_interval=5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_flush = time.time()
+
+        self.conn = sqlite3.connect(path, timeout=300,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            for sql in SCHEMA:
+                self.conn.execute(sql)
+
+    def get_objects(self, tenant, container, first, last):
+        """Get records of objects with name between first and last.
+
+        Return a dict of {name: (etag, bytes, last_modified, result)}.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT name, etag, bytes, last_modified, result '
+                'FROM objects WHERE tenant = ? AND container = ? '
+                'AND name >= ? AND name <= ?',
+                (tenant, container, first, last)
+            ).fetchall()
+
+        return dict((row[0], row[1:]) for row in rows)
+
+    def get_containers(self, tenant):
+        """Get progress of containers, {name: (marker, done)}."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT container, marker, done FROM containers '
+                'WHERE tenant = ?',
+                (tenant,)
+            ).fetchall()
+
+        return dict((row[0], (row[1], bool(row[2]))) for row in rows)
+
+    def record_object(self, tenant, container, item, result):
+        """Record the migration result of a source listing item."""
+        self._add(
+            'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (tenant, container, item['name'], item['hash'], item['bytes'],
+             item['last_modified'], result, time.time())
+        )
+
+    def set_marker(self, tenant, container, marker, done=False):
+        """Record all the objects up to marker have been handled."""
+        self._add(
+            'INSERT OR REPLACE INTO containers VALUES (?, ?, ?, ?)',
+            (tenant, container, marker, int(done))
+        )
+
+    def get_retries(self, tenant):
+        """Get the retry queue of tenant, [(container, name, attempts)]."""
+        with self.lock:
+            self._flush()
+            return self.conn.execute(
+                'SELECT container, name, attempts FROM retries '
+                'WHERE tenant = ? ORDER BY container, name',
+                (tenant,)
+            ).fetchall()
+
+    def get_retry_tenants(self):
+        """Get the tenants having objects in the retry queue."""
+        with self.lock:
+            self._flush()
+            rows = self.conn.execute(
+                'SELECT DISTINCT tenant FROM retries').fetchall()
+
+        return set(row[0] for row in rows)
+
+    def add_retry(self, tenant, container, name, error):
+        """Queue an object which failed to migrate."""
+        self._add(
+            'INSERT OR REPLACE INTO retries VALUES (?, ?, ?, '
+            'COALESCE((SELECT attempts FROM retries WHERE tenant = ? AND '
+            'container = ? AND name = ?), 0) + 1, ?, ?)',
+            (tenant, container, name, tenant, container, name, error,
+             time.time())
+        )
+
+    def remove_retry(self, tenant, container, name):
+        self._add(
+            'DELETE FROM retries WHERE tenant = ? AND container = ? '
+            'AND name = ?',
+            (tenant, container, name)
+        )
+
+    def reset_containers(self, tenant):
+        """Forget the progress of containers, for a new run of tenant."""
+        self._add('DELETE FROM containers WHERE tenant = ?', (tenant,))
+        self.flush()
+
+    def _add(self, sql, params):
+        with self.lock:
+            self.pending.append((sql, params))
+
+            if (len(self.pending) >= self.batch_size or
+                    time.time() - self.last_flush >= self.flush_interval):
+                self._flush()
+
+    def _flush(self):
+        if self.pending:
+            # Statements are committed in order and in one transaction.
+            with self.conn:
+                for sql, params in self.pending:
+                    self.conn.execute(sql, params)
+            self.pending = []
+
+        self.last_flush = time.time()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
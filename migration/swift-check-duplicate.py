@@ -139,11 +139,11 @@ def main():
         user_name, tenant_name, key, True, 2, args.authurl,
     )
     user, role = util.get_user_role(args, keyconn, user_name, args.role)
-    tenants_group = util.get_tenant_group(args, keyconn, multiprocess=False)
+    tenants = util.get_tenants(args, keyconn)
 
     print('\nStart to check duplicate container...')
 
-    _check_duplicate(tenants_group[0], args, key, keyconn, user, role)
+    _check_duplicate(tenants, args, key, keyconn, user, role)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import argparse
+import datetime
+import sys
+
+import inventory
+import progress
+
+MB = 1024 * 1024
+
+
+def _format_bound(bound):
+    if bound is None:
+        return '> %s' % progress.format_bytes(inventory.SIZE_BUCKETS[-1])
+    return '<= %s' % progress.format_bytes(bound)
+
+
+def _percent(value, total):
+    return 100.0 * value / total if total else 0.0
+
+
+def print_summary(inv):
+    flags = inv['flags']
+    total_bytes = int(inv['bytes'].sum())
+    stated = (flags & inventory.FLAG_HEADERS) != 0
+
+    print 70 * '='
+    print(
+        "Tenants: %s, containers: %s, objects: %s, size: %s" % (
+            len(inv['tenants']), len(inv['containers']), len(flags),
+            progress.format_bytes(total_bytes)
+        )
+    )
+    print(
+        "S3 multi-part objects: %s, objects stat'ed: %s (dynamic large "
+        "objects: %s, static large objects: %s)" % (
+            int(((flags & inventory.FLAG_MULTIPART) != 0).sum()),
+            int(stated.sum()),
+            int(((flags & inventory.FLAG_DLO) != 0).sum()),
+            int(((flags & inventory.FLAG_SLO) != 0).sum())
+        )
+    )
+    if len(flags):
+        print(
+            "Last modified: %s to %s" % (
+                datetime.datetime.utcfromtimestamp(
+                    inv['last_modified'].min()).isoformat(),
+                datetime.datetime.utcfromtimestamp(
+                    inv['last_modified'].max()).isoformat()
+            )
+        )
+
+
+def print_histogram(inv):
+    objects = len(inv['bytes'])
+    total_bytes = int(inv['bytes'].sum())
+
+    print 70 * '='
+    print('Object size histogram:')
+    for bound, count, bytes in inventory.size_histogram(inv):
+        print(
+            '%12s: objects: %10s (%5.1f%%), size: %8s (%5.1f%%)' % (
+                _format_bound(bound), count, _percent(count, objects),
+                progress.format_bytes(bytes), _percent(bytes, total_bytes)
+            )
+        )
+
+
+def print_tenants(inv, count):
+    print 70 * '='
+    print('Tenants by size (object size p50/p90/p99/max):')
+    for name, objects, bytes, percentiles, largest in (
+            inventory.tenant_distribution(inv)[:count]):
+        print(
+            '%35s: objects: %s, size: %s, %s' % (
+                name, objects, progress.format_bytes(bytes),
+                '/'.join(progress.format_bytes(v)
+                         for v in percentiles + [largest])
+            )
+        )
+
+
+def print_top_objects(inv, count):
+    print 70 * '='
+    print('Largest objects:')
+    for tenant, container, name, bytes in inventory.top_objects(inv, count):
+        print(
+            '\t%s: %s/%s, size: %s' % (
+                tenant, container, name, progress.format_bytes(bytes)
+            )
+        )
+
+
+def print_projection(inv, args):
+    total, largest = inventory.project_time(
+        inv, args.bandwidth * MB, args.object_overhead,
+        workers=args.concurrency, object_threads=args.object_threads)
+
+    print 70 * '='
+    print(
+        "Projected migration time with %s processes of %s object threads, "
+        "%sM/s and %ss overhead per transfer: %s (largest tenant: %s)" % (
+            args.concurrency, args.object_threads, args.bandwidth,
+            args.object_overhead, progress.format_eta(total),
+            progress.format_eta(largest)
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyze the inventory dumped by 'swift-migrate.py --act "
+                    "stat --inventory DIR'. NumPy is required."
+    )
+    parser.add_argument(
+        "inventory",
+        metavar="DIR",
+        help="Inventory directory."
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of largest objects to show. Default: 10"
+    )
+    parser.add_argument(
+        "--tenants",
+        type=int,
+        default=20,
+        help="Number of largest tenants to show. Default: 20"
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=progress.positive_float,
+        default=20,
+        help="Throughput of one transfer in MB/s, for the projected "
+             "migration time. Default: 20"
+    )
+    parser.add_argument(
+        "--object-overhead",
+        type=progress.non_negative_float,
+        default=0.05,
+        help="Seconds spent on requests for each object besides the "
+             "transfer, for the projected migration time. Default: 0.05"
+    )
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=progress.positive_int,
+        default=1,
+        help="Number of migration processes. Default: 1"
+    )
+    parser.add_argument(
+        "--object-threads",
+        type=progress.positive_int,
+        default=10,
+        help="Number of objects migrated at the same time by each process. "
+             "Default: 10"
+    )
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa
+    except ImportError:
+        print('Error: NumPy is required to analyze the inventory.')
+        sys.exit(1)
+
+    inv = inventory.load(args.inventory)
+
+    print_summary(inv)
+    print_histogram(inv)
+    print_tenants(inv, args.tenants)
+    print_top_objects(inv, args.top)
+    print_projection(inv, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,22 +14,44 @@
 #    under the License.
 
 import argparse
-from collections import Iterable
+import calendar
+import collections
 import getpass
+import functools
+import hashlib
+import heapq
+import itertools
 import json
+import math
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 import re
 import sys
-import tempfile
+import tarfile
+import threading
 import time
 import traceback
 
+from concurrent import futures
 import six
+from six.moves import queue
+from six.moves.urllib.parse import quote
+from six.moves.urllib.parse import unquote
+from six.moves.urllib.parse import urlparse
 import swiftclient
 from swiftclient.service import SwiftError
-from swiftclient.service import SwiftUploadObject
 
+import inventory
+import logwriter
+import metadata
+import metrics
+import progress
+import sampling
+import statedb
+import tee
+import throttle
+import tokencache
 import util
 
 # need b6457e0f95c2563f745bbfb64c739929bc0dc901 for body
@@ -49,12 +71,55 @@ OLD_TIMESTAMP_HEADER = 'x-object-meta-old-timestamp'
 # multi-part upload API.
 HASH_PATTERN = re.compile('\w+-\w+')
 
+# Headers of a container in RGW which are kept by the segment containers
+# created in Swift for its objects.
+SEGMENT_CONTAINER_HEADERS = ('x-container-read', 'x-container-write',
+                             'x-storage-policy')
+
+# The etag of an empty object.
+EMPTY_ETAG = 'd41d8cd98f00b204e9800998ecf8427e'
+
 GB_5 = 5368709120
 GB_SPLIT = 2147483648
 
+# Part sizes tried to rebuild the S3 multi-part hash of an object are
+# multiples of MB, at most MULTIPART_CANDIDATES of them.
+MB = 1024 * 1024
+MULTIPART_CANDIDATES = 3
+
+# Number of listing pages stat'ed ahead of the objects being transferred in
+# each container.
+STAT_AHEAD_PAGES = 2
+
+# Fraction of the objects stat'ed by each mode of '--act stat', the
+# 'sample' mode uses '--sample-rate'.
+STAT_SAMPLE_RATES = {'head': 1, 'listing': 0}
+
+# Priority of the jobs waiting for a transfer slot by ordering policy, from
+# the bytes of the job. Jobs with the same priority keep the listing order.
+ORDER_POLICIES = {
+    'listing': lambda bytes: 0,
+    'largest-first': lambda bytes: -bytes,
+    'smallest-first': lambda bytes: bytes,
+}
+
+# Number of threads used to get the size of all tenants before the tenants are
+# dispatched to worker processes.
+SIZING_THREADS = 16
+
 
 def _print_object_detail(src_srvclient, tenant_name, cname, content,
-                         max_size_info, object=None):
+                         max_size_info, object=None, sample_rate=1,
+                         sample=None, verbose=True, inventory_writer=None,
+                         engine=None):
+    """Print the objects of container, with the headers of sampled ones.
+
+    The listed objects and the sampled headers are counted in sample, and
+    added to the inventory if inventory_writer is given.
+    """
+    sample = sample if sample is not None else sampling.Sample()
+    engine = engine or metadata.ServiceEngine(src_srvclient)
+
     if object:
         stat_res = list(
             src_srvclient.stat(container=cname, objects=[object])
@@ -87,61 +152,88 @@ def _print_object_detail(src_srvclient, tenant_name, cname, content,
 
         return
 
-    for page in src_srvclient.list(container=cname):
-        if page["success"]:
-            object_names = [o['name'] for o in page["listing"]]
-            objects = list(
-                src_srvclient.stat(
-                    container=cname,
-                    objects=object_names)
-            )
-            object_mapping = {}
-            for o in objects:
-                object_mapping[o['object']] = o
-
-            for item in page["listing"]:
-                if item['bytes'] > max_size_info['size']:
-                    max_size_info.update({
-                        'tenant': tenant_name,
-                        'size': item['bytes'],
-                        'container': cname,
-                        'object': item['name']
-                    })
-
-                prefix = ('[large-object] '
-                          if HASH_PATTERN.match(item['hash'])
-                          else '')
+    for page in engine.list(cname):
+        if not page["success"]:
+            raise Exception(page["error"])
 
-                obj_stat = object_mapping[item['name']]
-                obj_header = obj_stat['headers']
+        # Only the sampled objects are stat'ed, sample_rate is 1 to stat all
+        # of them and 0 to only use the listing.
+        object_names = [o['name'] for o in page["listing"]
+                        if sample_rate and
+                        sampling.is_sampled(cname, o['name'], sample_rate)]
+        object_mapping = {}
+        if object_names:
+            for o in engine.stat(cname, object_names):
+                # Objects deleted since the listing are left out.
+                if o['success']:
+                    object_mapping[o['object']] = o
+
+        for item in page["listing"]:
+            if item['bytes'] > max_size_info['size']:
+                max_size_info.update({
+                    'tenant': tenant_name,
+                    'size': item['bytes'],
+                    'container': cname,
+                    'object': item['name']
+                })
+
+            is_multipart = bool(HASH_PATTERN.match(item['hash']))
+            prefix = '[large-object] ' if is_multipart else ''
+            sample.add_listed(is_multipart)
+
+            obj_stat = object_mapping.get(item['name'])
+            if obj_stat:
+                sample.add_headers(obj_stat['headers'])
+
+            if inventory_writer:
+                flags = inventory.FLAG_MULTIPART if is_multipart else 0
+                if obj_stat:
+                    flags |= inventory.header_flags(obj_stat['headers'])
+                inventory_writer.add(
+                    tenant_name, cname, item['name'], item['bytes'],
+                    item['hash'],
+                    _listing_timestamp(item['last_modified'])
+                    if item.get('last_modified') else 0, flags)
+
+            if not verbose:
+                continue
 
-                content.append(
-                    '            %s%s\t%s' % (
-                        prefix,
-                        item['name'],
-                        item['bytes'],
-                    )
+            content.append(
+                '            %s%s\t%s' % (
+                    prefix,
+                    item['name'],
+                    item['bytes'],
                 )
-                content.append('            ....headers: %s' % obj_header)
-        else:
-            raise Exception(page["error"])
+            )
+            if obj_stat:
+                content.append('            ....headers: %s' %
+                               obj_stat['headers'])
+            else:
+                content.append(
+                    '            ....hash: %s, last modified: %s, '
+                    'content type: %s' % (item['hash'],
+                                          item.get('last_modified'),
+                                          item.get('content_type')))
+
 
+def print_info(elapsed, stats):
+    totals = stats.totals()
 
-def print_info(elapsed, stats, tenant_usage, moved_stats):
     # Print total object storage information.
     print 70 * '='
     print "Elapsed time: {0}s".format(elapsed)
     print(
         "Total containers: %s, objects: %s, size: %.3fT" % (
-            stats['cons'],
-            stats['objs'],
-            float(stats['bytes']) / (1024 * 1024 * 1024 * 1024)
+            totals['containers'],
+            totals['objects'],
+            float(totals['bytes']) / (1024 * 1024 * 1024 * 1024)
         )
     )
 
     # Print tenant usage in descending order.
     sorted_tenant_usage = sorted(
-        tenant_usage.items(), key=lambda d: d[1], reverse=True)
+        ((name, counts['bytes']) for name, counts in stats.items()),
+        key=lambda d: d[1], reverse=True)
     print('Tenants have objects:')
     for name, usage in sorted_tenant_usage:
         if usage > 0:
@@ -149,29 +241,104 @@ def print_info(elapsed, stats, tenant_usage, moved_stats):
 
     # Print total moved objects.
     print 70 * '='
-    total_moved_count = 0
-    total_moved_bytes = 0
-    for tenant, moved in six.iteritems(moved_stats):
-        total_moved_count += moved['moved_objects']
-        total_moved_bytes += moved['moved_bytes']
-
     print "Total moved objects:"
     print(
         "\tobjects: %s, size: %.3fG" % (
-            total_moved_count,
-            float(total_moved_bytes) / (1024 * 1024 * 1024)
+            totals['moved_objects'],
+            float(totals['moved_bytes']) / (1024 * 1024 * 1024)
         )
     )
 
     # Print moved objects per tenant.
     print('Moved objects per tenant:')
-    for tenant, moved in six.iteritems(moved_stats):
+    for tenant, moved in stats.items():
         if moved['moved_bytes'] > 0:
             print(
                 '\t%s: objects: %s, size: %s' %
                 (tenant, moved['moved_objects'], moved['moved_bytes'])
             )
 
+    # Print the objects listed and the estimates from the sampled ones.
+    if totals['listed_objects']:
+        print 70 * '='
+        print('\n'.join(sampling.Sample(totals).report()))
+
+
+def _forecast_rates(args):
+    """Bandwidth of one transfer and overhead per object, for the forecast.
+
+    They are measured from the metrics file of a previous run if given,
+    otherwise they are taken from the options.
+    """
+    bandwidth = args.forecast_bandwidth * MB
+    overhead = args.forecast_overhead
+
+    if args.forecast_from:
+        samples = metrics.read_textfile(args.forecast_from)
+
+        def _get(name, **labels):
+            return samples.get(('%s_%s' % (metrics.PREFIX, name),
+                                tuple(sorted(labels.items()))), 0)
+
+        transfer_bytes = _get('bytes_total', phase='transfer')
+        upload_seconds = _get('phase_seconds_sum', phase='upload')
+        object_seconds = _get('phase_seconds_sum', phase='object')
+        objects = _get('phase_seconds_count', phase='object')
+
+        if transfer_bytes and upload_seconds:
+            bandwidth = transfer_bytes / upload_seconds
+        if objects:
+            overhead = max(0.0, (object_seconds - upload_seconds) / objects)
+
+    return bandwidth, overhead
+
+
+def print_plan(stats, args):
+    """Print what would be migrated, and how long it would take.
+
+    Each tenant takes the time of its objects (overhead plus transfer) over
+    the object threads, the tenants are spread over the processes, and the
+    migration takes at least the time of the largest tenant.
+    """
+    categories = ('normal', 'multipart', 'large', 'dlo', 'existing',
+                  'failed')
+    bandwidth, overhead = _forecast_rates(args)
+
+    def _tenant_seconds(counts):
+        return progress.tenant_seconds(
+            sum(counts['plan_%s_objects' % c] for c in categories[:4]),
+            sum(counts['plan_%s_bytes' % c] for c in categories[:4]),
+            bandwidth, overhead, object_threads=args.object_threads)
+
+    def _format(counts):
+        return ', '.join(
+            '%s: %s/%.3fG' % (c, counts['plan_%s_objects' % c],
+                              float(counts['plan_%s_bytes' % c]) /
+                              (1024 * 1024 * 1024))
+            for c in categories)
+
+    print 70 * '='
+    print('Objects/size to migrate per tenant:')
+    seconds = []
+    for tenant, counts in stats.items():
+        if not any(counts['plan_%s_objects' % c] for c in categories):
+            continue
+        seconds.append(_tenant_seconds(counts))
+        print('%35s: %s, forecast: %s' % (
+            tenant, _format(counts), progress.format_eta(seconds[-1])))
+
+    totals = stats.totals()
+    print('Total objects/size to migrate:')
+    print('\t%s' % _format(totals))
+    print(
+        "Forecast with %s processes of %s object threads, %.1fM/s per "
+        "transfer and %.3fs overhead per object: %s" % (
+            args.concurrency, args.object_threads, bandwidth / MB, overhead,
+            progress.format_eta(progress.run_seconds(
+                seconds, workers=args.concurrency)[0])
+        )
+    )
+
 
 def get_parser():
     parser = argparse.ArgumentParser()
@@ -191,6 +358,16 @@ def get_parser():
         default="8443"
     )
     parser.add_argument("-x", "--host", help="Swift proxy host name")
+    parser.add_argument(
+        "--tee-host",
+        metavar="HOST[:PORT]",
+        action="append",
+        default=[],
+        help="Another Swift proxy to migrate to at the same time, e.g. of "
+             "another region. Each object is read once from RGW and "
+             "uploaded to '--host' and to each '--tee-host'. Can be given "
+             "several times, the port is '--port' by default."
+    )
     parser.add_argument(
         "-p", "--port",
         help="Swift proxy port, Default: 8843",
@@ -205,11 +382,117 @@ def get_parser():
     )
     parser.add_argument(
         "-t", "--act",
-        choices=['stat', 'copy'],
+        choices=['stat', 'plan', 'copy', 'retry'],
         default="stat",
         help="Action to be performed. 'stat' means only get statistic of "
-             "object storage without migration, 'copy' means doing migration. "
-             "Default: stat"
+             "object storage without migration, 'plan' means comparing RGW "
+             "and Swift to count what 'copy' would migrate, 'copy' means "
+             "doing migration, 'retry' means migrating again only the "
+             "objects which failed in previous runs. Default: stat"
+    )
+    parser.add_argument(
+        "--forecast-from",
+        metavar="PATH",
+        help="Metrics file (--metrics-file) of a previous 'copy' run, to "
+             "measure the bandwidth and the overhead per object used by "
+             "'--act plan' to forecast the migration time.",
+    )
+    parser.add_argument(
+        "--forecast-bandwidth",
+        type=progress.positive_float,
+        default=20,
+        help="Throughput of one transfer in MB/s used by the forecast if "
+             "not measured. Default: 20"
+    )
+    parser.add_argument(
+        "--forecast-overhead",
+        type=progress.non_negative_float,
+        default=0.05,
+        help="Seconds per object besides the transfer used by the forecast "
+             "if not measured. Default: 0.05"
+    )
+    parser.add_argument(
+        "--stat-mode",
+        choices=['head', 'listing', 'sample'],
+        default='head',
+        help="How objects are detailed by '--act stat' with -v. 'head' "
+             "stats every object, 'listing' only uses the container "
+             "listings, 'sample' stats '--sample-rate' of the objects and "
+             "estimates the share of large objects and the metadata size "
+             "(also without -v). Default: head"
+    )
+    parser.add_argument(
+        "--sample-rate",
+        type=float,
+        default=0.01,
+        help="Fraction of the objects stat'ed by '--stat-mode sample'. "
+             "Default: 0.01"
+    )
+    parser.add_argument(
+        "--inventory",
+        metavar="DIR",
+        help="Directory to dump the inventory of all the objects listed by "
+             "'--act stat' to (tenant, container, name, bytes, hash, last "
+             "modified time, large object flags), for swift-inventory.py. "
+             "Without -v, only the listings are used and the large object "
+             "flags are only set for the sampled objects.",
+    )
+    parser.add_argument(
+        "--metadata-engine",
+        choices=['service', 'pooled'],
+        default='service',
+        help="How container listings and object HEADs are requested. "
+             "'service' uses the thread pools of swiftclient, 'pooled' uses "
+             "'--metadata-concurrency' threads with keep-alive connections, "
+             "for containers with lots of objects. Default: service"
+    )
+    parser.add_argument(
+        "--metadata-concurrency",
+        type=int,
+        default=100,
+        help="Number of listing or HEAD requests in flight in each worker "
+             "process with '--metadata-engine pooled'. Default: 100"
+    )
+    parser.add_argument(
+        "--order",
+        choices=sorted(ORDER_POLICIES),
+        default='listing',
+        help="Order in which the objects waiting for a transfer are "
+             "migrated. 'largest-first' starts the large objects early so "
+             "they do not end up in a long tail, 'smallest-first' gets the "
+             "most objects done early. Only the objects listed so far and "
+             "waiting (up to '--order-window') are ordered, not the whole "
+             "tenant. Default: listing"
+    )
+    parser.add_argument(
+        "--order-window",
+        type=progress.positive_int,
+        default=10000,
+        help="Number of objects waiting for a transfer in each process, "
+             "ordered by '--order'. The listing stops while the window is "
+             "full, so an object listed after it fills up can not go before "
+             "the objects already transferred. Default: 10000"
+    )
+    parser.add_argument(
+        "--compare",
+        choices=['head', 'listing'],
+        default="head",
+        help="How to find objects that need migration. 'head' means stat "
+             "every object on both sides, 'listing' means comparing the "
+             "container listings and only stat the objects which are new, "
+             "changed or large objects. Default: head"
+    )
+    parser.add_argument(
+        "--state-db",
+        help="Path of a local SQLite database to record the migration state "
+             "of objects. Objects migrated by a previous run and not changed "
+             "since then are skipped without any request to RGW or Swift."
+    )
+    parser.add_argument(
+        "--resume",
+        action='store_true',
+        help="Resume a killed run from where each container was stopped, "
+             "need --state-db."
     )
     parser.add_argument(
         "-v", "--verbose",
@@ -222,6 +505,123 @@ def get_parser():
         help="Number of processes need to be running. Default: 1",
         default=1
     )
+    parser.add_argument(
+        "--container-threads",
+        type=progress.positive_int,
+        help="Number of containers migrated at the same time in each "
+             "process. Default: 2",
+        default=2
+    )
+    parser.add_argument(
+        "--object-threads",
+        type=progress.positive_int,
+        help="Number of objects migrated at the same time in each process, "
+             "shared by all the containers being migrated. Default: 10",
+        default=10
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Adapt the number of objects transferred at the same time (up "
+             "to --object-threads) to the latency and the overload errors "
+             "(503/498/timeouts) of RGW and Swift. The level is logged when "
+             "it changes.",
+    )
+    parser.add_argument(
+        "--download-ranges",
+        type=int,
+        help="Number of segments of a single large object (> 5G) that are "
+             "downloaded with ranged GETs and uploaded at the same time. "
+             "Default: 4",
+        default=4
+    )
+    parser.add_argument(
+        "--bulk-threshold",
+        type=int,
+        help="Objects smaller than this size in bytes are uploaded in batches "
+             "with the bulk middleware (extract-archive) of Swift. 0 means "
+             "disabled. Default: 0",
+        default=0
+    )
+    parser.add_argument(
+        "--bulk-size",
+        type=int,
+        help="Maximum number of small objects in one bulk upload. "
+             "Default: 500",
+        default=500
+    )
+    parser.add_argument(
+        "--token-cache",
+        metavar="PATH",
+        help="File to keep the Keystone tokens of tenants in, shared by the "
+             "worker processes and by later runs. Tokens are only kept in "
+             "memory if not specified.",
+    )
+    parser.add_argument(
+        "--retry-db",
+        metavar="PATH",
+        help="SQLite database of the queue of objects which failed to "
+             "migrate, replayed by '--act retry'. "
+             "Default: swift-migrate-retry.db",
+        default="swift-migrate-retry.db"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        help="Number of times a transfer failing with a transient error "
+             "(5xx, 498, timeout, connection error) is retried in the same "
+             "run. Default: 3",
+        default=3
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        help="Base delay in seconds of the exponential backoff between "
+             "retries, the delays are randomized. Default: 1",
+        default=1.0
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=int,
+        help="Seconds between two prints of the progress, throughput and ETA "
+             "of the migration, over all the worker processes and for each "
+             "tenant in progress. 0 to disable. Default: 60",
+        default=60
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="Prometheus node-exporter textfile (*.prom) to write the "
+             "latency histograms, counters and throughput of the migration "
+             "phases to, aggregated across worker processes.",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=int,
+        help="Seconds between two writes of the metrics file. Default: 30",
+        default=30
+    )
+    parser.add_argument(
+        "--log-max-bytes",
+        type=int,
+        help="Size in bytes over which the output file of each worker "
+             "process is rotated, 0 to never rotate. Default: 104857600",
+        default=100 * MB
+    )
+    parser.add_argument(
+        "--log-backups",
+        type=int,
+        help="Number of rotated output files kept for each worker process. "
+             "Default: 5",
+        default=5
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        help="Size in bytes of the chunks read from object downloads. Larger "
+             "chunks mean less overhead for large objects. Default: 65536",
+        default=65536
+    )
     parser.add_argument(
         "--container",
         help="Container name needs to migrate.",
@@ -256,7 +656,8 @@ def get_parser():
 
 
 def stat_tenant(id, content, src_srvclient, max_size_info, tenant_name,
-                container=None, object=None):
+                container=None, object=None, sample_rate=1, sample=None,
+                verbose=True, inventory_writer=None, engine=None):
     if container:
         print('...[%02d] Processing container %s' % (id, container))
 
@@ -272,6 +673,13 @@ def stat_tenant(id, content, src_srvclient, max_size_info, tenant_name,
             if object:
                 _print_object_detail(src_srvclient, tenant_name, container,
                                      content, max_size_info, object=object)
+            elif inventory_writer:
+                _print_object_detail(src_srvclient, tenant_name, container,
+                                     content, max_size_info,
+                                     sample_rate=sample_rate, sample=sample,
+                                     verbose=False,
+                                     inventory_writer=inventory_writer,
+                                     engine=engine)
 
             return
         else:
@@ -290,7 +698,11 @@ def stat_tenant(id, content, src_srvclient, max_size_info, tenant_name,
 
                 # Print objects details.
                 _print_object_detail(src_srvclient, tenant_name, cname,
-                                     content, max_size_info)
+                                     content, max_size_info,
+                                     sample_rate=sample_rate, sample=sample,
+                                     verbose=verbose,
+                                     inventory_writer=inventory_writer,
+                                     engine=engine)
         else:
             raise Exception(page["error"])
 
@@ -327,8 +739,10 @@ def check_migrate_object(container_name, src_header, tgt_obj):
         return True
 
     # For normal object etag check. For some reason, the hash in
-    # 'container_list' output has '\x00' in the end.
-    if tgt_header['etag'] == src_etag.replace('\x00', ''):
+    # 'container_list' output has '\x00' in the end. The etag of a static
+    # large object is quoted.
+    if (tgt_header['etag'].strip('"') ==
+            src_etag.replace('\x00', '').strip('"')):
         return False
     # Do not move object if the lasted version is on Swift side
     elif origin_timestamp <= tgt_timestamp:
@@ -337,15 +751,87 @@ def check_migrate_object(container_name, src_header, tgt_obj):
     return True
 
 
+def _listing_timestamp(last_modified):
+    """Convert last_modified of a listing item to a unix timestamp.
+
+    Swift gives '2016-05-10T03:22:33.123450', RGW gives
+    '2016-05-10T03:22:33.000Z', both are in UTC.
+    """
+    timestamp = calendar.timegm(
+        time.strptime(last_modified[:19], '%Y-%m-%dT%H:%M:%S'))
+    fraction = last_modified[19:].rstrip('Z')
+
+    return timestamp + (float(fraction) if fraction else 0)
+
+
+class _ListingCursor(object):
+    """Walk through a container listing while looking up names in order."""
+
+    def __init__(self, list_res):
+        self._items = self._iter_items(list_res)
+        self._current = next(self._items, None)
+
+    @staticmethod
+    def _iter_items(list_res):
+        for page in list_res:
+            if not page["success"]:
+                raise Exception(page["error"])
+            for item in page["listing"]:
+                yield item
+
+    def find(self, name):
+        """Return the listing item of name, or None if it does not exist.
+
+        Names must be looked up in the listing order.
+        """
+        while self._current is not None and self._current['name'] < name:
+            self._current = next(self._items, None)
+
+        if self._current is not None and self._current['name'] == name:
+            return self._current
+        return None
+
+
+def compare_listing(src_item, tgt_item):
+    """Check whether we should migrate src object by the listings only.
+
+    Return 'new' if the object does not exist in target, 'existing' if it
+    does not need migration, or 'check' if the object headers are needed to
+    decide, see check_migrate_object.
+    """
+    if tgt_item is None:
+        return 'new'
+
+    # For some reason, the hash in 'container_list' output has '\x00' in the
+    # end.
+    src_etag = src_item['hash'].replace('\x00', '')
+
+    # Multi-part large object needs the old hash header of target object, and
+    # DLO manifest which is listed as an empty object needs its headers.
+    if (HASH_PATTERN.match(src_etag) or
+            (src_item['bytes'] == 0 and src_etag == EMPTY_ETAG)):
+        return 'check'
+
+    if src_etag == tgt_item['hash'] and src_item['bytes'] == tgt_item['bytes']:
+        return 'existing'
+    # Do not move object if the lasted version is on Swift side
+    elif (_listing_timestamp(src_item['last_modified']) <=
+            _listing_timestamp(tgt_item['last_modified'])):
+        return 'existing'
+
+    return 'check'
+
+
 def check_migrate_after(container_name, object_name, src_etag, tgt_srvclient,
                         is_dlo, content):
     content.append("             ..ok..checking")
 
-    tgt_obj = list(
-        tgt_srvclient.stat(
-            container=container_name,
-            objects=[object_name])
-    )[0]
+    with metrics.timer('verify'):
+        tgt_obj = list(
+            tgt_srvclient.stat(
+                container=container_name,
+                objects=[object_name])
+        )[0]
 
     if not tgt_obj['success']:
         raise Exception(tgt_obj['error'])
@@ -355,113 +841,513 @@ def check_migrate_after(container_name, object_name, src_etag, tgt_srvclient,
         # the end.
         tgt_header = tgt_obj['headers']
         if (not tgt_header.get(OLD_HASH_HEADER, False) and
-                tgt_header['etag'] != src_etag.replace('\x00', '')):
+                tgt_header['etag'].strip('"') !=
+                src_etag.replace('\x00', '').strip('"')):
             raise Exception('src and target objects have different hashes.')
 
     content.append("             ..ok")
 
 
+def _delete_segments(conn, manifest):
+    """Delete the segments of a dynamic large object manifest."""
+    seg_container, prefix = unquote(manifest).split('/', 1)
+    marker = ''
+
+    while True:
+        listing = conn.get_container(seg_container, prefix=prefix,
+                                     marker=marker)[1]
+        if not listing:
+            return
+        for item in listing:
+            conn.delete_object(seg_container, item['name'])
+        marker = listing[-1]['name']
+
+
+def _put_dlo_manifest(conn, container_name, object_name, headers,
+                      delete_old=False):
+    """Create a dynamic large object manifest, with an empty body.
+
+    SwiftService.upload() is not used for manifests, it deletes the segments
+    of the object it replaces even if the new manifest points to the same
+    ones. With delete_old, the segments of the previous manifest are deleted
+    after the new manifest is created, only if they are other segments.
+    """
+    old_manifest = None
+    if delete_old:
+        try:
+            old_manifest = conn.head_object(
+                container_name, object_name).get('x-object-manifest')
+        except swiftclient.ClientException as e:
+            if e.http_status != 404:
+                raise
+
+    conn.put_object(container_name, object_name, b'', headers=headers)
+
+    if (old_manifest and
+            unquote(old_manifest) != unquote(headers['x-object-manifest'])):
+        _delete_segments(conn, old_manifest)
+
+
 def migrate_DLO(container_name, object_name, src_head, src_srvclient,
                 tgt_srvclient):
-    """Migrate dynamic large object."""
-    headers = ['x-object-manifest:%s' % src_head['x-object-manifest']]
-    headers.append(
-        '%s:%s' % (OLD_TIMESTAMP_HEADER, src_head['x-timestamp']))
+    """Migrate dynamic large object.
 
-    upload_iter = tgt_srvclient.upload(
-        container_name,
-        [SwiftUploadObject(None, object_name=object_name)],
-        options={'header': headers}
-    )
+    Only the manifest is created, the segments are objects of the tenant
+    which are migrated on their own, so they are never deleted.
+    """
+    headers = {
+        'x-object-manifest': src_head['x-object-manifest'],
+        OLD_TIMESTAMP_HEADER: src_head['x-timestamp'],
+    }
 
-    for r in upload_iter:
-        if not r['success']:
-            raise Exception(r['error'])
+    util.call_with_connection(tgt_srvclient, _put_dlo_manifest,
+                              container_name, object_name, headers)
 
 
-def migrate_SLO(container_name, object_name, src_head, src_srvclient,
-                tgt_srvclient):
-    """Migrate static large object.
+def _get_manifest(conn, container_name, object_name):
+    return conn.get_object(container_name, object_name,
+                           query_string='multipart-manifest=get')
+
+
+def _head_container(conn, container_name):
+    return conn.head_container(container_name)
+
+
+def _head_object(conn, container_name, object_name):
+    return conn.head_object(container_name, object_name)
+
+
+def _create_container(conn, container_name, headers):
+    """Create container with headers, unless it exists already.
+
+    An existing container is left as it is, a PUT would change its ACLs or
+    fail if its storage policy is another one.
+    """
+    try:
+        conn.head_container(container_name)
+    except swiftclient.ClientException as e:
+        if e.http_status != 404:
+            raise
+        conn.put_container(container_name, headers=headers)
+
+
+def _create_segment_container(src_srvclient, tgt_srvclients, container_name,
+                              seg_container):
+    """Create seg_container in the targets if they do not have it.
+
+    It gets the ACLs and storage policy of container_name in RGW.
+    """
+    head = util.call_with_connection(src_srvclient, _head_container,
+                                     container_name)
+    headers = dict((name, value) for name, value in head.items()
+                   if name in SEGMENT_CONTAINER_HEADERS)
+    for tgt_srvclient in tgt_srvclients:
+        util.call_with_connection(tgt_srvclient, _create_container,
+                                  seg_container, headers)
+
+
+def _put_manifest(conn, container_name, object_name, manifest, headers):
+    return conn.put_object(container_name, object_name, manifest,
+                           headers=headers,
+                           query_string='multipart-manifest=put')
+
+
+def _split_segment_path(path):
+    """Container and object name of a segment path '/container/object'."""
+    return path.lstrip('/').split('/', 1)
+
+
+def _migrate_slo_segment(seg_container, segment_name, size, etag,
+                         src_srvclient, tgt_srvclient, chunk_size=65536):
+    """Copy one segment of a static large object, and verify it."""
+    def _copy(headers, reader):
+        segment_reader = _VerifyingReader(reader)
+        put_etag = upload_object(tgt_srvclient, seg_container, segment_name,
+                                 segment_reader, chunk_size=chunk_size)
+        return segment_reader, put_etag
+
+    segment_reader, put_etag = download_object(
+        src_srvclient, seg_container, segment_name, _copy,
+        chunk_size=chunk_size)
+    metrics.count('bytes_total', segment_reader.bytes, phase='transfer')
+
+    md5 = segment_reader.md5.hexdigest()
+    if segment_reader.bytes != size:
+        raise Exception('got %s bytes of %s bytes from segment %s.' %
+                        (segment_reader.bytes, size, segment_name))
+    if md5 != etag.strip('"') or (put_etag and put_etag != md5):
+        raise Exception('Hash of segment %s does not match the content '
+                        'uploaded.' % segment_name)
+
+
+def migrate_SLO(container_name, object_name, src_srvclient, tgt_srvclient,
+                content, src_head=None, ranges=1, chunk_size=65536):
+    """Migrate static large object, segment by segment.
 
     Note that static large object (slo) does not actually work with RGW as of
     0.9.4.x, so hopefully not too many of these. We migrate them anyway.
 
-    It's a little difficult to upload the SLO manifest file before we are sure
-    all the segments are uploaded to Swift. When the PUT operation sees the
-    ?multipart-manifest=put query parameter, it reads the request body and
-    verifies that each segment object exists and that the sizes and ETags
-    match. If there is a mismatch, the PUT operation fails.
-    """
-    with tempfile.NamedTemporaryFile() as temp_file:
-        down_res_iter = src_srvclient.download(
-            container=container_name,
-            objects=[object_name],
-            options={'out_file': temp_file.name, 'checksum': False}
-        )
+    The manifest is fetched with ?multipart-manifest=get, the segments which
+    are not in Swift yet (or differ) are copied, 'ranges' of them at the same
+    time, and the manifest is rebuilt at the end. When the PUT operation sees
+    the ?multipart-manifest=put query parameter, it verifies that each
+    segment object exists and that the sizes and ETags match, so the manifest
+    is only created once all the segments are there. A failed migration is
+    resumed from the segments already copied. Segments which are manifests
+    themselves are migrated the same way first.
+
+    The manifest is created with the content type and metadata of src_head,
+    the headers of the object in RGW (HEADed if not given): the GET of the
+    manifest returns it as application/json.
+    """
+    if src_head is None:
+        src_head = util.call_with_connection(
+            src_srvclient, _head_object, container_name, object_name)
+    _, body = util.call_with_connection(
+        src_srvclient, _get_manifest, container_name, object_name)
+    segments = json.loads(body)
+
+    # Segments with the same path are copied only once.
+    paths = collections.OrderedDict()
+    for segment in segments:
+        paths.setdefault(segment['name'], segment)
+
+    by_container = collections.defaultdict(list)
+    for path, segment in paths.items():
+        if not segment.get('sub_slo'):
+            seg_container, segment_name = _split_segment_path(path)
+            by_container[seg_container].append((segment_name, segment))
+
+    todo = []
+    for seg_container, container_segments in by_container.items():
+        # Make sure the segment container exists in Swift, like the one in
+        # RGW.
+        _create_segment_container(src_srvclient, [tgt_srvclient],
+                                  seg_container, seg_container)
+
+        # The results come as the HEADs complete, not in order.
+        tgt_objs = dict(
+            (res['object'], res) for res in tgt_srvclient.stat(
+                container=seg_container,
+                objects=[name for name, segment in container_segments]))
+        for segment_name, segment in container_segments:
+            tgt_obj = tgt_objs[segment_name]
+            if (tgt_obj['success'] and
+                    tgt_obj['headers']['etag'].strip('"') ==
+                    segment['hash'].strip('"') and
+                    int(tgt_obj['headers']['content-length']) ==
+                    segment['bytes']):
+                continue
+            todo.append((seg_container, segment_name, segment))
 
-        for down_res in down_res_iter:
-            if down_res['success']:
-                headers = ['x-static-large-object:True']
+    content.append('            ..[static large object] %s segments, %s to '
+                   'copy' % (len(paths), len(todo)))
 
-                upload_iter = tgt_srvclient.upload(
-                    container_name,
-                    [SwiftUploadObject(temp_file.name,
-                                       object_name=object_name)],
-                    options={'header': headers}
-                )
-                for r in upload_iter:
-                    if not r['success']:
-                        raise Exception(r['error'])
-            else:
-                raise Exception(down_res['error'])
-
-    # src_objtype = src_head['content-type']
-    # src_objlen = src_head['content-length']
-    #
-    # tgt_ohead = {}
-    # tgt_ohead['x-static-large-object'] = src_head['x-static-large-object']
-    #
-    # src_obj = src_swiftcon.get_object(
-    #     container_name, src_object['name'],
-    #     query_string='multipart-manifest=get'
-    # )
-    # src_objdata = src_obj[1]
-    #
-    # # reconstruct valid manifest from saved debug manifest object
-    # # body - the dict keys are *wrong*...wtf
-    # tgt_parsed_objdata = []
-    # src_parsed_objdata = json.loads(src_objdata)
-    #
-    # for parsed_item in src_parsed_objdata:
-    #     parsed_item['size_bytes'] = parsed_item.pop('bytes')
-    #     parsed_item['etag'] = parsed_item.pop('hash')
-    #     parsed_item['path'] = parsed_item.pop('name')
-    #     for key in parsed_item.keys():
-    #         if (key != 'size_bytes' and key != 'etag'
-    #             and key != 'path' and key != 'range'):
-    #             parsed_item.pop(key)
-    #     tgt_parsed_objdata.append(parsed_item)
-    #
-    # tgt_objdata = json.dumps(tgt_parsed_objdata)
-    #
-    # tgt_swiftcon.put_object(container_name, src_object['name'],
-    #                         contents=tgt_objdata, content_type=src_objtype,
-    #                         content_length=src_objlen, headers=tgt_ohead)
+    for path, segment in paths.items():
+        if segment.get('sub_slo'):
+            seg_container, segment_name = _split_segment_path(path)
+            migrate_SLO(seg_container, segment_name, src_srvclient,
+                        tgt_srvclient, content, ranges=ranges,
+                        chunk_size=chunk_size)
+
+    if todo:
+        pool = futures.ThreadPoolExecutor(max(min(ranges, len(todo)), 1))
+        try:
+            _wait_jobs([pool.submit(
+                _migrate_slo_segment, todo_container, todo_name,
+                todo_segment['bytes'], todo_segment['hash'], src_srvclient,
+                tgt_srvclient, chunk_size
+            ) for todo_container, todo_name, todo_segment in todo])
+        finally:
+            pool.shutdown()
+
+    manifest = []
+    for segment in segments:
+        entry = {'path': segment['name'], 'etag': segment['hash'],
+                 'size_bytes': segment['bytes']}
+        if segment.get('range'):
+            entry['range'] = segment['range']
+        manifest.append(entry)
+
+    headers = dict(h.split(':', 1)
+                   for h in get_object_user_meta(src_head))
+    headers['content-type'] = src_head.get('content-type', '')
+    headers[OLD_TIMESTAMP_HEADER] = src_head.get('x-timestamp', '')
+
+    with metrics.timer('upload'):
+        util.call_with_connection(tgt_srvclient, _put_manifest,
+                                  container_name, object_name,
+                                  json.dumps(manifest), headers)
 
 
 class _ReadableContent(object):
-    def __init__(self, reader):
+    """File-like adapter of object content downloaded in chunks.
+
+    read() never returns more than the requested size and returns an empty
+    string at the end of the content. A downloaded chunk which fits in the
+    requested size is handed over as it is, otherwise it is sliced through a
+    memoryview so the rest of it is not copied again on the next read.
+    """
+
+    def __init__(self, reader, chunk_size=65536):
         self.reader = reader
         self.content_iterator = iter(self.reader)
+        self.chunk_size = chunk_size
+        self.pending = None
 
-    def read(self, chunk_size):
-        """Read content of object.
+    def _next_chunk(self):
+        """Get the downloaded data that has not been read yet."""
+        if self.pending is not None and len(self.pending):
+            return self.pending
+
+        self.pending = None
+        for chunk in self.content_iterator:
+            if len(chunk):
+                return chunk
+
+        return b''
+
+    def read(self, chunk_size=None):
+        """Read content of object, at most 'chunk_size' bytes.
+
+        Read the whole content left if 'chunk_size' is negative, and read
+        self.chunk_size bytes if it is not given.
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if chunk_size < 0:
+            return b''.join(iter(self._read_chunk, b''))
+
+        chunk = self._next_chunk()
+        if len(chunk) <= chunk_size:
+            self.pending = None
+            return chunk if isinstance(chunk, bytes) else chunk.tobytes()
+
+        view = memoryview(chunk)
+        self.pending = view[chunk_size:]
+        return view[:chunk_size].tobytes()
+
+    def _read_chunk(self):
+        return self.read(self.chunk_size)
 
-        the 'chunk_size' param is not used here, but it's passed by uploading
-        process. For object downloading and uploading, the default
-        chunk size is the same(65536 by default).
+    def readinto(self, buffer):
+        """Read content of object into a preallocated buffer.
+
+        Return the number of bytes read, 0 at the end of the content.
         """
-        return self.content_iterator.next()
+        view = memoryview(buffer)
+        size = len(view)
+        filled = 0
+
+        while filled < size:
+            chunk = self._next_chunk()
+            if not len(chunk):
+                break
+
+            chunk = memoryview(chunk)
+            length = min(len(chunk), size - filled)
+            view[filled:filled + length] = chunk[:length]
+            self.pending = chunk[length:]
+            filled += length
+
+        return filled
+
+    def __iter__(self):
+        return iter(self._read_chunk, b'')
+
+
+class _SegmentReader(object):
+    """Read one segment of a large object from its download content."""
+
+    def __init__(self, reader, size):
+        self.reader = reader
+        self.remaining = size
+
+    def read(self, chunk_size):
+        chunk = self.reader.read(min(chunk_size, self.remaining))
+        self.remaining -= len(chunk)
+        return chunk
+
+
+def _get_object(conn, container_name, object_name, headers, chunk_size,
+                fn):
+    with metrics.timer('download'):
+        resp_headers, body = conn.get_object(
+            container_name, object_name, resp_chunk_size=chunk_size,
+            headers=headers)
+
+    try:
+        return fn(resp_headers, _ReadableContent(body, chunk_size))
+    except Exception:
+        # The content may not be read to the end, the connection can not be
+        # used for another request.
+        conn.close()
+        raise
+
+
+def download_object(srvclient, container_name, object_name, fn,
+                    headers=None, chunk_size=65536):
+    """Download object as a stream, return fn(headers, readable content).
+
+    The download is done with one of the connections of the service client,
+    instead of SwiftService.download() which always reads in 64K chunks and
+    checks the md5 of the content. The content is streamed from the
+    connection, so fn is called while the connection is held, and must read
+    the content to the end.
+    """
+    return util.call_with_connection(
+        srvclient, _get_object, container_name, object_name, headers or {},
+        chunk_size, fn
+    )
+
+
+class _MultipartETag(object):
+    """Rebuild the S3 multi-part hash of an object from its content.
+
+    The hash is the md5 of the md5 digests of the parts, followed by the
+    number of parts. The part size is not known, so the hash is computed for
+    the part sizes (multiples of MB, which S3 clients use) giving the right
+    number of parts for the object size, at most MULTIPART_CANDIDATES of
+    them.
+    """
+
+    def __init__(self, size, etag):
+        self.etag = etag
+        parts = int(etag.rsplit('-', 1)[1])
+
+        if parts <= 1:
+            part_sizes = [max(size, 1)]
+        else:
+            # The first parts have the same size, the last one is smaller.
+            low = int(math.ceil(size / float(parts)))
+            high = (size - 1) // (parts - 1)
+            first = int(math.ceil(low / float(MB)))
+            part_sizes = [k * MB for k in
+                          range(first, first + MULTIPART_CANDIDATES)
+                          if k * MB <= high]
+
+        # [part size, md5 of current part, digests of parts, bytes in part]
+        self.states = [[part_size, hashlib.md5(), [], 0]
+                       for part_size in part_sizes]
+
+    def update(self, chunk):
+        for state in self.states:
+            view = memoryview(chunk)
+            while len(view):
+                length = min(len(view), state[0] - state[3])
+                state[1].update(view[:length])
+                state[3] += length
+                view = view[length:]
+
+                if state[3] == state[0]:
+                    state[2].append(state[1].digest())
+                    state[1] = hashlib.md5()
+                    state[3] = 0
+
+    def matches(self):
+        """Whether one of the rebuilt hashes is the hash of the object."""
+        for part_size, md5, digests, filled in self.states:
+            if filled:
+                digests = digests + [md5.digest()]
+
+            etag = '%s-%s' % (hashlib.md5(b''.join(digests)).hexdigest(),
+                              len(digests))
+            if etag == self.etag:
+                return True
+
+        return False
+
+
+class _VerifyingReader(object):
+    """Compute the md5 of content while it is read for upload."""
+
+    def __init__(self, reader, size=None, multipart_etag=None):
+        self.reader = reader
+        self.md5 = hashlib.md5()
+        self.bytes = 0
+        self.multipart = None
+        if multipart_etag and size is not None:
+            self.multipart = _MultipartETag(size, multipart_etag)
+
+    def read(self, chunk_size):
+        chunk = self.reader.read(chunk_size)
+        self.md5.update(chunk)
+        self.bytes += len(chunk)
+        if self.multipart:
+            self.multipart.update(chunk)
+        return chunk
+
+
+def _put_stream(conn, container_name, object_name, contents, **kwargs):
+    """PUT contents which can only be read once.
+
+    swiftclient can not send them again when the request fails, it raises an
+    error about resetting them instead, without the status or socket error.
+    So the request is not retried by swiftclient, the real error is raised
+    to the retries of the object and to the concurrency limiter.
+    """
+    retries = conn.retries
+    conn.retries = 0
+    try:
+        return conn.put_object(container_name, object_name, contents,
+                               **kwargs)
+    finally:
+        conn.retries = retries
+
+
+def _put_object(conn, container_name, object_name, contents, headers,
+                chunk_size):
+    return _put_stream(conn, container_name, object_name, contents,
+                       headers=headers, chunk_size=chunk_size)
+
+
+def upload_object(srvclient, container_name, object_name, reader,
+                  header_list=(), chunk_size=65536):
+    """Upload content with one of the connections, return the etag.
+
+    Unlike SwiftService.upload(), the target object is not HEAD'ed before the
+    upload. 'header_list' is a list of 'key:value' strings.
+    """
+    headers = dict(h.split(':', 1) for h in header_list)
+
+    with metrics.timer('upload'):
+        etag = util.call_with_connection(
+            srvclient, _put_object, container_name, object_name, reader,
+            headers, chunk_size
+        )
+    return etag.strip('"') if etag else etag
+
+
+def verify_upload(reader, size, src_etag, put_etag, content):
+    """Verify an upload with the md5 computed while streaming.
+
+    The md5 of the bytes sent is compared with the etag returned by the
+    upload and with the source etag. For multi-part hashes, the hash is
+    rebuilt from the content if the part size can be found, otherwise only
+    the upload is checked.
+    """
+    content.append("             ..ok..checking")
+    started = time.time()
+
+    md5 = reader.md5.hexdigest()
+    src_etag = src_etag.replace('\x00', '').strip('"')
+
+    if reader.bytes != int(size):
+        raise Exception('got %s bytes of %s bytes from src object.' %
+                        (reader.bytes, size))
+    if put_etag and put_etag != md5:
+        raise Exception('target object hash %s is not the hash %s of the '
+                        'content uploaded.' % (put_etag, md5))
+
+    if HASH_PATTERN.match(src_etag):
+        if not (reader.multipart and reader.multipart.matches()):
+            content.append("             ..multi-part hash not rebuilt, "
+                           "only upload checked")
+    elif src_etag != md5:
+        raise Exception('src and target objects have different hashes.')
+
+    metrics.observe('verify', time.time() - started)
+    content.append("             ..ok")
 
 
 def get_object_user_meta(object_header):
@@ -474,9 +1360,146 @@ def get_object_user_meta(object_header):
     return user_meta_list
 
 
+def _read_chunks(reader, chunk_size):
+    return iter(lambda: reader.read(chunk_size), b'')
+
+
+def _upload_chunks(srvclient, container_name, object_name, header_list,
+                   chunk_size, chunks):
+    return upload_object(srvclient, container_name, object_name,
+                         _ReadableContent(chunks, chunk_size), header_list,
+                         chunk_size=chunk_size)
+
+
+def upload_to_targets(tgt_srvclients, container_name, object_name, reader,
+                      header_list=(), chunk_size=65536):
+    """Upload content read once to each target, return the upload futures.
+
+    The futures give the etags, in the order of the targets.
+    """
+    return tee.fan_out(
+        _read_chunks(reader, chunk_size),
+        [functools.partial(_upload_chunks, srvclient, container_name,
+                           object_name, header_list, chunk_size)
+         for srvclient in tgt_srvclients]
+    )
+
+
+def _target_name(srvclient):
+    return urlparse(srvclient._options['os_storage_url']).netloc
+
+
+def _migrate_segment(container_name, object_name, seg_container,
+                     segment_name, start, size, src_srvclient,
+                     tgt_srvclients, chunk_size=65536):
+    """Download a byte range of object and upload it as one segment."""
+    def _copy(headers, reader):
+        segment_reader = _VerifyingReader(_SegmentReader(reader, size))
+        jobs = upload_to_targets(tgt_srvclients, seg_container, segment_name,
+                                 segment_reader, chunk_size=chunk_size)
+        metrics.count('bytes_total', segment_reader.bytes, phase='transfer')
+
+        # Make sure we got exactly the range.
+        if segment_reader.bytes != size or reader.read(1):
+            raise Exception('Range %s-%s of object is not honored.' %
+                            (start, start + size - 1))
+        return segment_reader, jobs
+
+    segment_reader, jobs = download_object(
+        src_srvclient, container_name, object_name, _copy,
+        headers={'Range': 'bytes=%s-%s' % (start, start + size - 1)},
+        chunk_size=chunk_size
+    )
+
+    # Make sure the segment stored is what we have sent.
+    for job in jobs:
+        put_etag = job.result()
+        if put_etag and put_etag != segment_reader.md5.hexdigest():
+            raise Exception('Hash of segment %s does not match the content '
+                            'uploaded.' % segment_name)
+
+
+def migrate_large_object(container_name, object_name, src_byte, src_head,
+                         header_list, src_srvclient, tgt_srvclients, ranges=1,
+                         chunk_size=65536):
+    """Migrate single large object as dynamic large object.
+
+    The object is split into segments of GB_SPLIT bytes. Each segment is
+    downloaded with a ranged GET and uploaded to each target while its bytes
+    are being downloaded, 'ranges' segments at the same time, so nothing is
+    written to local disk. The manifests are created at the end. The
+    segments of a previous version of the object are deleted then, the
+    segments of the same version are reused if the manifest is created
+    again, e.g. by a retry.
+    """
+    full_size = int(src_byte)
+    seg_container = container_name + '_segments'
+    seg_prefix = '%s/%s/%s/%s' % (object_name, src_head['x-timestamp'],
+                                  full_size, GB_SPLIT)
+    segments = int(math.ceil(full_size / float(GB_SPLIT)))
+
+    # The segments are uploaded with plain PUTs, which do not create the
+    # container.
+    _create_segment_container(src_srvclient, tgt_srvclients, container_name,
+                              seg_container)
+
+    pool = futures.ThreadPoolExecutor(max(min(ranges, segments), 1))
+    try:
+        jobs = []
+        for segment in range(segments):
+            start = segment * GB_SPLIT
+            jobs.append(pool.submit(
+                _migrate_segment, container_name, object_name, seg_container,
+                '%s/%08d' % (seg_prefix, segment), start,
+                min(GB_SPLIT, full_size - start), src_srvclient,
+                tgt_srvclients, chunk_size
+            ))
+        _wait_jobs(jobs)
+    finally:
+        pool.shutdown()
+
+    manifest = '%s/%s/' % (quote(seg_container.encode('utf8')),
+                           quote(seg_prefix.encode('utf8')))
+    headers = dict(h.split(':', 1) for h in header_list)
+    headers['x-object-manifest'] = manifest
+    for tgt_srvclient in tgt_srvclients:
+        util.call_with_connection(tgt_srvclient, _put_dlo_manifest,
+                                  container_name, object_name, headers,
+                                  delete_old=True)
+
+
+def _verify_targets(tgt_srvclients, jobs, verify, content):
+    """Verify the upload to each target, the targets done are removed.
+
+    The error of the first target which failed is raised after all the
+    targets are verified, so that only the failed ones are migrated again.
+    """
+    exc_info = None
+    for tgt_srvclient, job in zip(list(tgt_srvclients), jobs):
+        if len(jobs) > 1:
+            content.append("             ..%s" % _target_name(tgt_srvclient))
+        try:
+            verify(job.result())
+        except Exception:
+            exc_info = exc_info or sys.exc_info()
+            if len(jobs) > 1:
+                content.append("             ..failed. Reason: %s" %
+                               sys.exc_info()[1])
+        else:
+            tgt_srvclients.remove(tgt_srvclient)
+
+    if exc_info:
+        six.reraise(*exc_info)
+
+
 def migrate_object(container_name, object_name, src_byte, src_head,
-                   src_srvclient, tgt_srvclient, content):
-    """Migrate normal object."""
+                   src_srvclient, tgt_srvclients, content, ranges=1,
+                   chunk_size=65536):
+    """Migrate normal object to each target, and verify it.
+
+    The object is downloaded once for all the targets. The targets done are
+    removed from tgt_srvclients, so that a retry only goes to the others.
+    """
     single_large_object = True if int(src_byte) > GB_5 else False
 
     # Get user's customized object metadata, format:
@@ -491,155 +1514,846 @@ def migrate_object(container_name, object_name, src_byte, src_head,
 
     if single_large_object:
         content.append('            ..[large object]download...split...upload')
+        migrate_large_object(container_name, object_name, src_byte, src_head,
+                             header_list, src_srvclient, tgt_srvclients,
+                             ranges=ranges, chunk_size=chunk_size)
+        del tgt_srvclients[:]
+        content.append("             ..ok")
+    else:
+        # Download normal object as a stream, the content is verified with
+        # the md5 computed while it is uploaded.
+        def _copy(headers, readalbe_content):
+            reader = _VerifyingReader(
+                readalbe_content, int(src_byte),
+                src_head['etag'] if HASH_PATTERN.match(src_head['etag'])
+                else None
+            )
+            jobs = upload_to_targets(tgt_srvclients, container_name,
+                                     object_name, reader, header_list,
+                                     chunk_size=chunk_size)
+            return reader, jobs
+
+        reader, jobs = download_object(src_srvclient, container_name,
+                                       object_name, _copy,
+                                       chunk_size=chunk_size)
+        metrics.count('bytes_total', reader.bytes, phase='transfer')
+
+        _verify_targets(
+            tgt_srvclients, jobs,
+            lambda put_etag: verify_upload(reader, src_byte, src_head['etag'],
+                                           put_etag, content),
+            content
+        )
 
-        with tempfile.NamedTemporaryFile() as temp_file:
-            down_res = list(src_srvclient.download(
-                container=container_name,
-                objects=[object_name],
-                options={'out_file': '-', 'checksum': False}
-            ))[0]
-            contents = down_res['contents']
-            assert isinstance(contents, Iterable)
-
-            # Hacking here to avoid download checksum.
-            # TODO: Remove this when swiftclient version > 3.0.0
-            contents._expected_etag = None
-
-            for chunk in contents:
-                temp_file.file.write(chunk)
-
-            # Upload large object with segments.
-            upload_iter = tgt_srvclient.upload(
-                container_name,
-                [SwiftUploadObject(temp_file.name,
-                                   object_name=object_name)],
-                options={'header': header_list,
-                         'segment_size': GB_SPLIT,
-                         'checksum': False}
+
+class _TenantContext(object):
+    """State shared by the threads migrating one tenant."""
+
+    def __init__(self, id, args, tenant, content, src_srvclient,
+                 tgt_srvclient, stats, container_pool, object_pool,
+                 state=None, limiter=None, retry_queue=None, tracker=None,
+                 src_meta=None, tgt_meta=None, tee_srvclients=None,
+                 tee_meta=None):
+        self.id = id
+        self.args = args
+        self.tenant = tenant
+        self.content = content
+        self.src_srvclient = src_srvclient
+        self.tgt_srvclient = tgt_srvclient
+        self.stats = stats
+        self.container_pool = container_pool
+        self.object_pool = object_pool
+        self.state = state
+        self.retry_queue = retry_queue
+        self.tracker = tracker or progress.Tracker(id)
+        # Listings and object HEADs go through the metadata engines.
+        self.src_meta = src_meta or metadata.ServiceEngine(src_srvclient)
+        self.tgt_meta = tgt_meta or metadata.ServiceEngine(tgt_srvclient)
+        # The --tee-host targets get the same objects as the target, each
+        # object is read once for all of them.
+        self.tee_srvclients = tee_srvclients or []
+        self.tee_meta = tee_meta or [metadata.ServiceEngine(srvclient)
+                                     for srvclient in self.tee_srvclients]
+        self.lock = threading.Lock()
+
+        # Bound the transfers submitted to the object pool but not finished
+        # yet, the limit is adapted to the clusters if the limiter is
+        # adaptive.
+        self.limiter = limiter or throttle.AIMDLimiter(
+            args.object_threads, minimum=args.object_threads)
+
+        # Jobs waiting for the limiter, handed out by the ordering policy.
+        # Up to --order-window jobs wait, from all the containers of the
+        # tenant, so that e.g. large objects start before the small ones
+        # listed before them. The order only holds inside this window: the
+        # listings are not read ahead of it, so it is not a global order of
+        # the tenant.
+        self.order_key = ORDER_POLICIES[args.order]
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.order_cond = threading.Condition(threading.RLock())
+
+        # Progress of containers recorded in the state database, only used
+        # when resuming a killed run.
+        self.containers_progress = {}
+        if state and args.act == 'copy':
+            if args.resume:
+                self.containers_progress = state.get_containers(tenant.id)
+            else:
+                state.reset_containers(tenant.id)
+
+    def submit(self, bytes, fn, *args):
+        """Submit fn(ctx, *args), transferring bytes, to the object pool.
+
+        Return a future of the job. Wait if there are --order-window jobs
+        waiting for the limiter already.
+        """
+        future = futures.Future()
+        with self.order_cond:
+            while len(self.waiting) >= self.args.order_window:
+                self.order_cond.wait()
+            heapq.heappush(self.waiting, (self.order_key(bytes),
+                                          next(self.sequence), future, fn,
+                                          args))
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """Hand out the waiting jobs to the object pool, if allowed."""
+        with self.order_cond:
+            while self.waiting and self.limiter.acquire(blocking=False):
+                future, fn, args = heapq.heappop(self.waiting)[2:]
+                job = self.object_pool.submit(fn, self, *args)
+                job.add_done_callback(functools.partial(self._done, future))
+            self.order_cond.notify_all()
+
+    def _done(self, future, job):
+        self.limiter.release()
+        exception, tb = job.exception_info()
+        if exception is None:
+            future.set_result(job.result())
+        else:
+            future.set_exception_info(exception, tb)
+        self._dispatch()
+
+    def observe(self, lines, started, bytes=0, exc=None):
+        """Report a finished transfer to the limiter."""
+        message = self.limiter.observe(
+            time.time() - started, bytes,
+            overloaded=exc is not None and throttle.is_overload_error(exc))
+        if message:
+            print('...[%02d] %s' % (self.id, message))
+            lines.append('            ..%s' % message)
+
+    def write(self, content, lines):
+        """Append lines to content in one go, so they are not interleaved."""
+        with self.lock:
+            content.extend(lines)
+
+    def add_moved(self, bytes):
+        with self.lock:
+            self.stats.add(self.tenant.name, moved_objects=1,
+                           moved_bytes=bytes)
+        self.tracker.add(1, bytes, moved=True)
+
+    def add_plan(self, plan):
+        """Count the {category: [objects, bytes]} planned for migration."""
+        counts = {}
+        for category, (objects, bytes) in plan.items():
+            counts['plan_%s_objects' % category] = objects
+            counts['plan_%s_bytes' % category] = bytes
+        with self.lock:
+            self.stats.add(self.tenant.name, **counts)
+
+    def add_handled(self, objects, bytes):
+        """Count objects handled but not moved, for the progress."""
+        self.tracker.add(objects, bytes)
+
+    def get_records(self, container_name, listing):
+        """Get state records of the objects in a listing page."""
+        if not self.state or not listing or 'hash' not in listing[0]:
+            return {}
+
+        return self.state.get_objects(self.tenant.id, container_name,
+                                      listing[0]['name'],
+                                      listing[-1]['name'])
+
+    def record(self, container_name, item, result, error=None):
+        # Only the items from a real listing can be recorded.
+        if self.state and 'hash' in item:
+            self.state.record_object(self.tenant.id, container_name, item,
+                                     result)
+
+        # Failed objects are queued for --act retry, which removes the ones
+        # migrated from the queue. Objects deleted from the source are
+        # removed by any run.
+        if self.retry_queue:
+            if result == 'failed':
+                self.retry_queue.add_retry(self.tenant.id, container_name,
+                                           item['name'], str(error))
+            elif self.args.act == 'retry' or result == 'deleted':
+                self.retry_queue.remove_retry(self.tenant.id, container_name,
+                                              item['name'])
+
+    def save_marker(self, container_name, marker, done=False):
+        if self.state:
+            self.state.set_marker(self.tenant.id, container_name, marker,
+                                  done=done)
+
+
+def _wait_jobs(jobs):
+    """Wait for all the jobs, then raise the first error if there is any."""
+    futures.wait(jobs)
+    for job in jobs:
+        job.result()
+
+
+def _is_known_good(record, item):
+    """Whether the listing item has not changed since it was migrated."""
+    if not record:
+        return False
+
+    etag, bytes, last_modified, result = record
+    return (result in ('ok', 'existing') and etag == item['hash'] and
+            bytes == item['bytes'] and last_modified == item['last_modified'])
+
+
+def _transfer_object(ctx, container_name, object_name, src_ohead, src_byte,
+                     lines, targets):
+    """Migrate the object to targets, the targets done are removed."""
+    if src_ohead.get('x-object-manifest', False):
+        # Only the manifest is created, nothing to check.
+        for tgt_srvclient in list(targets):
+            migrate_DLO(container_name, object_name, src_ohead,
+                        ctx.src_srvclient, tgt_srvclient)
+            targets.remove(tgt_srvclient)
+        lines.append("             ..ok")
+    elif src_ohead.get('x-static-large-object', False):
+        # The segments which are missing are copied for each target.
+        for tgt_srvclient in list(targets):
+            migrate_SLO(container_name, object_name, ctx.src_srvclient,
+                        tgt_srvclient, lines, src_head=src_ohead,
+                        ranges=ctx.args.download_ranges,
+                        chunk_size=ctx.args.chunk_size)
+            check_migrate_after(
+                container_name, object_name, src_ohead['etag'],
+                tgt_srvclient, False, lines
             )
-            for r in upload_iter:
-                if not r['success']:
-                    raise Exception(r['error'])
+            targets.remove(tgt_srvclient)
     else:
-        # Download normal object, the contents in response is an iterable
-        # object. We don't do checksum for download/upload, will do that
-        # outside this method.
-        down_res = list(
-            src_srvclient.download(
-                container=container_name,
-                objects=[object_name],
-                options={'out_file': '-', 'checksum': False}
-            )
-        )[0]
-        contents = down_res['contents']
-        assert isinstance(contents, Iterable)
+        migrate_object(container_name, object_name, src_byte,
+                       src_ohead, ctx.src_srvclient, targets,
+                       lines, ranges=ctx.args.download_ranges,
+                       chunk_size=ctx.args.chunk_size)
 
-        # Hacking here to avoid download checksum.
-        # TODO: Remove this when swiftclient version > 3.0.0
-        contents._expected_etag = None
 
-        readalbe_content = _ReadableContent(contents)
+def _tee_targets(ctx, container_name, object_name, src_ohead):
+    """The --tee-host targets which need the object."""
+    targets = []
+    for tgt_srvclient in ctx.tee_srvclients:
+        with metrics.timer('tgt_head'):
+            tgt_obj = list(tgt_srvclient.stat(container=container_name,
+                                              objects=[object_name]))[0]
+        if check_migrate_object(container_name, src_ohead, tgt_obj):
+            targets.append(tgt_srvclient)
+    return targets
 
-        upload_iter = tgt_srvclient.upload(
-            container_name,
-            [SwiftUploadObject(readalbe_content,
-                               object_name=object_name)],
-            options={'header': header_list, 'checksum': False}
-        )
 
-        for r in upload_iter:
-            if not r['success']:
-                raise Exception(r['error'])
+def migrate_one_object(ctx, container_name, item, src_obj, tgt_obj, content):
+    """Migrate one object of the listing page, never raise.
+
+    Transfers failing with transient errors are retried up to --retries
+    times, with jittered exponential backoff.
+    """
+    lines = []
+    result = 'failed'
+    object_name = src_obj['object']
+    started = time.time()
+    src_byte = 0
+    error = None
+
+    try:
+        if not src_obj['success']:
+            # Deleted since it was listed or queued, nothing to migrate.
+            if throttle.is_not_found_error(src_obj['error']):
+                lines.append('            deleted object: %s' % object_name)
+                result = 'deleted'
+                return
+            raise Exception(src_obj['error'])
+
+        src_ohead = src_obj['headers']
+        src_byte = src_obj['items'][4][1]
+        is_dlo = src_ohead.get('x-object-manifest', False)
+
+        # First, check if migration is needed, and to which targets.
+        targets = []
+        if check_migrate_object(container_name, src_ohead, tgt_obj):
+            targets.append(ctx.tgt_srvclient)
+        targets.extend(_tee_targets(ctx, container_name, object_name,
+                                    src_ohead))
+        if not targets:
+            lines.append('            existing object: %s' % object_name)
+            result = 'existing'
+            return
+
+        lines.append(
+            '            creating object: %s,\tbytes: %s' %
+            (object_name, src_byte))
+        if ctx.tee_srvclients:
+            lines.append('             ..targets: %s' %
+                         ', '.join(_target_name(t) for t in targets))
+
+        attempt = 0
+        while True:
+            try:
+                _transfer_object(ctx, container_name, object_name, src_ohead,
+                                 src_byte, lines, targets)
+                break
+            except Exception as e:
+                if (attempt >= ctx.args.retries or
+                        not throttle.is_transient_error(e)):
+                    raise
+
+                ctx.observe(lines, started, int(src_byte), e)
+                delay = throttle.backoff_delay(attempt,
+                                               ctx.args.retry_backoff)
+                lines.append('             ..retrying in %.1fs. Reason: %s' %
+                             (delay, str(e)))
+                time.sleep(delay)
+                attempt += 1
+                started = time.time()
+
+        # Update moved stats
+        ctx.add_moved(0 if is_dlo else int(src_byte))
+        result = 'ok'
+    except Exception as e:
+        error = e
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        err_lines = traceback.format_exception(exc_type, exc_value,
+                                               exc_traceback)
+        err_msg = ''.join(line for line in err_lines)
+        lines.append("             ..failed. Reason: %s" % err_msg)
+    finally:
+        if result not in ('existing', 'deleted'):
+            ctx.observe(lines, started, int(src_byte), error)
+            metrics.observe('object', time.time() - started)
+        if result != 'ok':
+            ctx.add_handled(1, int(item.get('bytes') or src_byte))
+        metrics.count('objects_total', result=result)
+        ctx.record(container_name, item, result, error=error)
+        ctx.write(content, lines)
+
+
+def _is_small_object(args, container_name, src_obj, tgt_obj):
+    """Whether the object can be migrated in a bulk archive upload.
+
+    Only plain small objects which need migration are uploaded in archives.
+    Object metadata can't be set by bulk archive upload, so objects with user
+    metadata or multi-part hash are left to migrate_one_object.
+    """
+    if not args.bulk_threshold or not src_obj['success']:
+        return False
+
+    header = src_obj['headers']
+    return (int(src_obj['items'][4][1]) < args.bulk_threshold and
+            not HASH_PATTERN.match(header['etag']) and
+            not header.get('x-object-manifest', False) and
+            not header.get('x-static-large-object', False) and
+            not get_object_user_meta(header) and
+            check_migrate_object(container_name, header, tgt_obj))
+
+
+def _small_objects_archive(src_srvclient, container_name, batch, archived,
+                           chunk_size=65536):
+    """Generate a tar archive of small objects, as a stream.
+
+    Objects are downloaded one by one. The objects which fail to download or
+    have a different hash are left out, the hash of the objects in the archive
+    are put in 'archived'.
+    """
+    for item, src_obj, tgt_obj in batch:
+        object_name = src_obj['object']
+        src_etag = src_obj['headers']['etag']
+
+        try:
+            data = download_object(
+                src_srvclient, container_name, object_name,
+                lambda headers, reader: reader.read(-1),
+                chunk_size=chunk_size)
+        except Exception:
+            continue
+
+        etag = hashlib.md5(data).hexdigest()
+        if etag != src_etag.replace('\x00', ''):
+            continue
 
+        info = tarfile.TarInfo(object_name.encode('utf-8'))
+        info.size = len(data)
+        info.mtime = int(float(src_obj['headers']['x-timestamp']))
 
-def migrate_container(container_name, src_srvclient, tgt_srvclient, content,
-                      object=None, moved_stats=None):
+        yield info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8')
+        yield data
+        if len(data) % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE -
+                                 len(data) % tarfile.BLOCKSIZE)
+
+        archived[object_name] = etag
+
+    # End of archive.
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+def _put_archive(conn, container_name, archive):
+    _put_stream(conn, container_name, None, archive,
+                query_string='extract-archive=tar',
+                headers={'Accept': 'application/json'})
+
+
+def _upload_archive(srvclient, container_name, archive):
+    util.call_with_connection(srvclient, _put_archive, container_name,
+                              archive)
+
+
+def _list_range(conn, container_name, first, last):
+    """Get the listing of objects from first to last, both included."""
+    items = []
+    marker = first[:-1]
+
+    while True:
+        listing = conn.get_container(container_name, marker=marker)[1]
+        items.extend(i for i in listing if first <= i['name'] <= last)
+
+        if not listing or listing[-1]['name'] >= last:
+            return items
+        marker = listing[-1]['name']
+
+
+def migrate_small_objects(ctx, container_name, batch, content):
+    """Migrate a batch of small objects with one bulk archive upload.
+
+    The objects are put into a tar archive which is streamed to the bulk
+    middleware of Swift (extract-archive) of each target, then the hash of
+    each object is checked in the target container listings. The objects
+    which can not be verified are migrated one by one. Never raise.
+    """
+    lines = []
+    archived = {}
+    verified = set()
+    started = time.time()
+    error = None
+
+    try:
+        archive = _small_objects_archive(ctx.src_srvclient, container_name,
+                                         batch, archived,
+                                         chunk_size=ctx.args.chunk_size)
+        targets = [ctx.tgt_srvclient] + ctx.tee_srvclients
+        with metrics.timer('bulk_upload'):
+            _wait_jobs(tee.fan_out(
+                archive,
+                [functools.partial(_upload_archive, srvclient,
+                                   container_name)
+                 for srvclient in targets]
+            ))
+
+        if archived:
+            names = sorted(archived)
+            verified.update(archived)
+            for srvclient in targets:
+                verified.intersection_update(
+                    item['name'] for item in util.call_with_connection(
+                        srvclient, _list_range, container_name, names[0],
+                        names[-1])
+                    if archived.get(item['name']) == item['hash'])
+    except Exception as e:
+        error = e
+        lines.append('            bulk upload of %s objects failed. '
+                     'Reason: %s' % (len(batch), str(e)))
+
+    ctx.observe(lines, started,
+                sum(int(src_obj['items'][4][1]) for _, src_obj, _ in batch),
+                error)
+
+    for item, src_obj, tgt_obj in batch:
+        object_name = src_obj['object']
+
+        if object_name in verified:
+            src_byte = int(src_obj['items'][4][1])
+            lines.append(
+                '            creating object: %s,\tbytes: %s' %
+                (object_name, src_byte))
+            lines.append('             ..ok(bulk)')
+            ctx.add_moved(src_byte)
+            metrics.count('bytes_total', src_byte, phase='bulk_upload')
+            metrics.count('objects_total', result='ok')
+            ctx.record(container_name, item, 'ok')
+        else:
+            migrate_one_object(ctx, container_name, item, src_obj, tgt_obj,
+                               content)
+
+    ctx.write(content, lines)
+
+
+def _stat_pages(ctx, container_name, list_res, tgt_listing, stat_queue,
+                tee_listings=()):
+    """The stat stage of the container pipeline.
+
+    Each listing page is stat'ed on both source and target, then handed over
+    to the transfer stage through a bounded queue, so the next pages are
+    listed and stat'ed while the objects of this page are being transferred.
+
+    Objects recorded as migrated in the state database and not changed since
+    then are skipped without any request. When tgt_listing is given, objects
+    are compared with the target listing and only the ones that can not be
+    decided from the listings are stat'ed. Objects are only existing if they
+    are existing in the tee_listings of the --tee-host targets too.
+    """
+    try:
+        for page in metrics.timed_iter('listing', list_res):
+            if not page["success"]:
+                raise Exception(page["error"])
+
+            listing = page["listing"]
+            records = ctx.get_records(container_name, listing)
+            stat_page = {
+                'marker': listing[-1]['name'] if listing else None,
+                'items': {},
+                'names': [],
+                'known': [],
+                'existing': [],
+                'src': {},
+                'tgt': {},
+            }
+            tgt_names = []
+
+            for item in listing:
+                name = item['name']
+                stat_page['items'][name] = item
+
+                if _is_known_good(records.get(name), item):
+                    stat_page['known'].append(name)
+                    continue
+
+                if tgt_listing:
+                    result = compare_listing(item, tgt_listing.find(name))
+                    if result == 'existing' and not all(
+                            compare_listing(item, l.find(name)) == 'existing'
+                            for l in tee_listings):
+                        result = 'check'
+                    if result == 'existing':
+                        stat_page['existing'].append(name)
+                        continue
+                    if result == 'new':
+                        stat_page['tgt'][name] = {
+                            'success': False,
+                            'object': name,
+                            'error': 'not found in target listing'
+                        }
+                    else:
+                        tgt_names.append(name)
+                else:
+                    tgt_names.append(name)
+
+                stat_page['names'].append(name)
+
+            # Get all the objects status by bulk query to save API calls. The
+            # bulk query on target is submitted before waiting for source.
+            started = time.time()
+            objects = []
+            if stat_page['names']:
+                objects = ctx.src_meta.stat(container_name,
+                                            stat_page['names'])
+            tgt_objects = []
+            if tgt_names:
+                tgt_objects = ctx.tgt_meta.stat(container_name, tgt_names)
+
+            # The timers measure the bulk query of a page.
+            for o in objects:
+                stat_page['src'][o['object']] = o
+            if stat_page['names']:
+                metrics.observe('src_head', time.time() - started)
+            for o in tgt_objects:
+                stat_page['tgt'][o['object']] = o
+            if tgt_names:
+                metrics.observe('tgt_head', time.time() - started)
+
+            stat_queue.put((stat_page, None))
+    except Exception:
+        stat_queue.put((None, sys.exc_info()))
+    finally:
+        stat_queue.put(None)
+
+
+def _object_size(item, src_obj):
+    if src_obj['success']:
+        return int(src_obj['items'][4][1])
+    return int(item.get('bytes', 0))
+
+
+def _batch_size(batch):
+    return sum(_object_size(item, src_obj) for item, src_obj, tgt_obj in batch)
+
+
+def migrate_container(ctx, container_name, content, object=None,
+                      marker=None, objects=None):
+    """Migrate the objects of container, or only the given objects."""
     if object:
+        objects = [object]
+
+    if objects:
         list_res = [
             {
                 'success': True,
-                'listing': [{'name': object}]
+                'listing': [{'name': name} for name in objects[i:i + 1000]]
             }
+            for i in range(0, len(objects), 1000)
         ]
     else:
-        list_res = src_srvclient.list(container=container_name)
+        list_res = ctx.src_meta.list(container_name, marker)
+
+    tgt_listing = None
+    tee_listings = []
+    if ctx.args.compare == 'listing' and not objects:
+        tgt_listing = _ListingCursor(
+            ctx.tgt_meta.list(container_name, marker))
+        tee_listings = [_ListingCursor(engine.list(container_name, marker))
+                        for engine in ctx.tee_meta]
+
+    stat_queue = queue.Queue(maxsize=STAT_AHEAD_PAGES)
+    stat_thread = threading.Thread(
+        target=_stat_pages,
+        args=(ctx, container_name, list_res, tgt_listing, stat_queue,
+              tee_listings)
+    )
+    stat_thread.daemon = True
+    stat_thread.start()
+
+    # The transfer stage, each object is transferred then verified in the
+    # object pool. The number of objects waiting in the pool is bounded.
+    jobs = []
+    # Pages which are not finished yet, (marker, jobs) in listing order.
+    pages = collections.deque()
+    exc_info = None
+
+    for page, exc_info in iter(stat_queue.get, None):
+        if exc_info:
+            break
+
+        metrics.count('objects_total',
+                      len(page['known']) + len(page['existing']),
+                      result='existing')
+        ctx.add_handled(
+            len(page['known']) + len(page['existing']),
+            sum(int(page['items'][name].get('bytes', 0))
+                for name in page['known'] + page['existing']))
+        for name in page['existing']:
+            ctx.record(container_name, page['items'][name], 'existing')
+        ctx.write(content, ['            existing object: %s' % name
+                            for name in page['known'] + page['existing']])
+
+        page_jobs = []
+        # Small objects are migrated in batches, which never span pages so
+        # that the marker of a page is saved only after all its objects.
+        batch = []
+        for name in page['names']:
+            item = page['items'][name]
+            src_obj = page['src'][name]
+            tgt_obj = page['tgt'][name]
+
+            if not objects and _is_small_object(ctx.args, container_name,
+                                                src_obj, tgt_obj):
+                batch.append((item, src_obj, tgt_obj))
+                if len(batch) >= ctx.args.bulk_size:
+                    page_jobs.append(ctx.submit(
+                        _batch_size(batch), migrate_small_objects,
+                        container_name, batch, content))
+                    batch = []
+                continue
 
-    for page in list_res:
-        if not page["success"]:
-            raise Exception(page["error"])
+            page_jobs.append(ctx.submit(
+                _object_size(item, src_obj), migrate_one_object,
+                container_name, item, src_obj, tgt_obj, content))
 
-        # Get all the objects status by bulk query to save API calls.
-        object_names = [o['name'] for o in page["listing"]]
-        objects = list(
-            src_srvclient.stat(
-                container=container_name,
-                objects=object_names)
-        )
-        object_mapping = {}
-        for o in objects:
-            object_mapping[o['object']] = o
+        if batch:
+            page_jobs.append(ctx.submit(
+                _batch_size(batch), migrate_small_objects, container_name,
+                batch, content))
 
-        # Do the same for target object storage.
-        tgt_objects = list(
-            tgt_srvclient.stat(
-                container=container_name,
-                objects=object_names)
-        )
-        tgt_object_mapping = {}
-        for o in tgt_objects:
-            tgt_object_mapping[o['object']] = o
-
-        for src_data in page["listing"]:
-            object_name = src_data['name']
-            src_obj = object_mapping[object_name]
-            tgt_obj = tgt_object_mapping[object_name]
-            src_ohead = src_obj['headers']
-            src_byte = src_obj['items'][4][1]
-            is_dlo = src_ohead.get('x-object-manifest', False)
-
-            # First, check if migration is needed.
-            if not check_migrate_object(container_name, src_ohead, tgt_obj):
-                content.append(
-                    '            existing object: %s' % object_name)
-                continue
+        jobs = [j for j in jobs if not j.done()] + page_jobs
+        if not objects:
+            pages.append((page['marker'], page_jobs))
 
-            content.append(
-                '            creating object: %s,\tbytes: %s' %
-                (object_name, src_byte))
+        # Save the marker of the pages which have been handled.
+        while pages and all(j.done() for j in pages[0][1]):
+            ctx.save_marker(container_name, pages.popleft()[0])
+
+    _wait_jobs(jobs)
+
+    if exc_info:
+        for marker, page_jobs in pages:
+            ctx.save_marker(container_name, marker)
+        six.reraise(*exc_info)
+
+    if not objects:
+        ctx.save_marker(container_name, pages[-1][0] if pages else marker,
+                        done=True)
+
+
+def migrate_one_container(ctx, cname, object=None):
+    """Create the container in target if needed, then migrate its objects."""
+    src_srvclient = ctx.src_srvclient
+    tgt_srvclient = ctx.tgt_srvclient
+    content = ctx.content.bind(container=cname)
+
+    marker, done = ctx.containers_progress.get(cname, (None, False))
+    if done:
+        return
+
+    print('...[%02d] Processing container %s' % (ctx.id, cname))
+
+    containe_stat = src_srvclient.stat(container=cname)
+    header = containe_stat['headers']
 
+    header_list = []
+    if header.has_key('x-container-read'):
+        header_list.append(
+            "X-Container-Read:%s" % header['x-container-read'])
+    if header.has_key('x-container-write'):
+        header_list.append(
+            "X-Container-Write:%s" % header['x-container-write'])
+    tgt_options = {'header': header_list}
+
+    # create container in the targets if it does not exist
+    for srvclient in [tgt_srvclient] + ctx.tee_srvclients:
+        where = ''
+        if srvclient is not tgt_srvclient:
+            where = ' in %s' % _target_name(srvclient)
+        try:
+            srvclient.stat(container=cname)
+        except SwiftError:
+            content.append('........creating container: %s%s' %
+                           (cname, where))
             try:
-                if is_dlo:
-                    migrate_DLO(container_name, object_name, src_ohead,
-                                src_srvclient, tgt_srvclient)
-                elif src_ohead.get('x-static-large-object', False):
-                    # This is not gonna happen.
-                    migrate_SLO(container_name, object_name, src_ohead,
-                                src_srvclient, tgt_srvclient)
-                else:
-                    migrate_object(container_name, object_name, src_byte,
-                                   src_ohead, src_srvclient, tgt_srvclient,
-                                   content)
-
-                # Check hash and etag after uploading, don't check DLO.
-                check_migrate_after(
-                    container_name, object_name, src_ohead['etag'],
-                    tgt_srvclient, is_dlo, content
-                )
+                srvclient.post(container=cname, options=tgt_options)
+                content.append("........ok")
+            except SwiftError as e:
+                content.append("........failed. Reason: %s" % str(e))
+                return
+        else:
+            content.append('........existing container: %s%s' %
+                           (cname, where))
+
+    if marker:
+        content.append('........resuming from object: %s' % marker)
+
+    with metrics.timer('container'):
+        migrate_container(ctx, cname, content, object=object, marker=marker)
+
 
-                # Update moved stats
-                moved_stats['moved_objects'] += 1
-                if not is_dlo:
-                    moved_stats['moved_bytes'] += int(src_byte)
-            except Exception:
-                exc_type, exc_value, exc_traceback = sys.exc_info()
-                lines = traceback.format_exception(exc_type, exc_value,
-                                                   exc_traceback)
-                err_msg = ''.join(line for line in lines)
-                content.append("             ..failed. Reason: %s" % err_msg)
+def retry_tenant(ctx):
+    """Migrate the objects of tenant in the retry queue.
 
+    Only the queued objects are stat'ed and migrated, containers are neither
+    listed nor created.
+    """
+    queued = collections.OrderedDict()
+    for container_name, name, attempts in ctx.retry_queue.get_retries(
+            ctx.tenant.id):
+        queued.setdefault(container_name, []).append(name)
+
+    for container_name, names in queued.items():
+        print('...[%02d] Retrying %s objects of container %s' %
+              (ctx.id, len(names), container_name))
+        content = ctx.content.bind(container=container_name)
+        content.append('........retrying %s objects of container: %s' %
+                       (len(names), container_name))
+
+        try:
+            migrate_container(ctx, container_name, content, objects=names)
+        except Exception as e:
+            content.append("........failed. Reason: %s" % str(e))
+
+
+def _plan_category(src_header, size):
+    if src_header.get('x-object-manifest', False):
+        return 'dlo'
+    if size > GB_5:
+        return 'large'
+    if HASH_PATTERN.match(src_header['etag']):
+        return 'multipart'
+    return 'normal'
 
-def migrate_tenant(id, content, src_srvclient, tgt_srvclient, container=None,
-                   object=None, moved_stats=None):
+
+def plan_one_container(ctx, cname):
+    """Count the objects and bytes of container which need migration.
+
+    Objects are compared like when migrating them, but nothing is written to
+    the target, nor to the state database.
+    """
+    content = ctx.content.bind(container=cname)
+    plan = collections.defaultdict(lambda: [0, 0])
+
+    print('...[%02d] Planning container %s' % (ctx.id, cname))
+
+    try:
+        ctx.tgt_srvclient.stat(container=cname)
+    except SwiftError:
+        # Every object is new, no need to ask the target.
+        tgt_listing = _ListingCursor([])
+    else:
+        tgt_listing = None
+        if ctx.args.compare == 'listing':
+            tgt_listing = _ListingCursor(ctx.tgt_meta.list(cname))
+
+    stat_queue = queue.Queue(maxsize=STAT_AHEAD_PAGES)
+    stat_thread = threading.Thread(
+        target=_stat_pages,
+        args=(ctx, cname, ctx.src_meta.list(cname), tgt_listing, stat_queue)
+    )
+    stat_thread.daemon = True
+    stat_thread.start()
+
+    exc_info = None
+    for page, exc_info in iter(stat_queue.get, None):
+        if exc_info:
+            break
+
+        for name in page['known'] + page['existing']:
+            plan['existing'][0] += 1
+            plan['existing'][1] += int(page['items'][name].get('bytes', 0))
+
+        for name in page['names']:
+            src_obj = page['src'][name]
+            size = int(page['items'][name].get('bytes', 0))
+
+            if not src_obj['success']:
+                category = 'failed'
+            elif check_migrate_object(cname, src_obj['headers'],
+                                      page['tgt'][name]):
+                size = int(src_obj['items'][4][1])
+                category = _plan_category(src_obj['headers'], size)
+                # Only the manifest of a DLO is copied.
+                if category == 'dlo':
+                    size = 0
+            else:
+                category = 'existing'
+
+            plan[category][0] += 1
+            plan[category][1] += size
+
+    content.append('........plan: %s' % ', '.join(
+        '%s: %s objects, %s bytes' % (category, objects, bytes)
+        for category, (objects, bytes) in sorted(plan.items())))
+    ctx.add_plan(plan)
+
+    if exc_info:
+        six.reraise(*exc_info)
+
+
+def _each_container(ctx, fn, container=None, **kwargs):
+    """Call fn(ctx, container_name, **kwargs) for the containers of tenant.
+
+    The containers are handled in the container pool.
+    """
     if container:
         list_res = [
             {
@@ -648,46 +2362,27 @@ def migrate_tenant(id, content, src_srvclient, tgt_srvclient, container=None,
             }
         ]
     else:
-        list_res = src_srvclient.list()
+        list_res = ctx.src_srvclient.list()
 
-    for page in list_res:
+    for page in metrics.timed_iter('account_listing', list_res):
         if page["success"]:
+            jobs = []
             for container in page["listing"]:
-                cname = container['name']
-                print('...[%02d] Processing container %s' % (id, cname))
+                jobs.append(ctx.container_pool.submit(
+                    fn, ctx, container['name'], **kwargs
+                ))
+            _wait_jobs(jobs)
+        else:
+            raise Exception(page["error"])
 
-                containe_stat = src_srvclient.stat(container=cname)
-                header = containe_stat['headers']
-
-                header_list = []
-                if header.has_key('x-container-read'):
-                    header_list.append(
-                        "X-Container-Read:%s" % header['x-container-read'])
-                if header.has_key('x-container-write'):
-                    header_list.append(
-                        "X-Container-Write:%s" % header['x-container-write'])
-                tgt_options = {'header': header_list}
-
-                # create container in target if it does not exist
-                try:
-                    tgt_srvclient.stat(container=cname)
-                except SwiftError:
-                    content.append('........creating container: %s' % cname)
-                    try:
-                        tgt_srvclient.post(container=cname,
-                                           options=tgt_options)
-                        content.append("........ok")
-                    except SwiftError as e:
-                        content.append("........failed. Reason: %s" % str(e))
-                        continue
-                else:
-                    content.append('........existing container: %s' % cname)
 
-                migrate_container(cname, src_srvclient, tgt_srvclient, content,
-                                  object=object, moved_stats=moved_stats)
+def plan_tenant(ctx, container=None):
+    _each_container(ctx, plan_one_container, container=container)
 
-        else:
-            raise Exception(page["error"])
+
+def migrate_tenant(ctx, container=None, object=None):
+    _each_container(ctx, migrate_one_container, container=container,
+                    object=object)
 
 
 def _get_connections(tenant, args, key):
@@ -739,93 +2434,305 @@ def _get_connections(tenant, args, key):
     return src_swiftcon, tgt_swiftcon
 
 
-def _get_service_clients(tenant, args, key):
+def _get_service_clients(args, key, tokens):
+    """Get the service clients of RGW and Swift, shared by all the tenants.
+
+    The service clients are created without tenant, they are pointed to each
+    tenant with _switch_tenant(), so that their connections to the storage
+    hosts are kept alive from one tenant to the next.
+    """
     tgt_srvclient = None
 
-    storurl = 'https://%s:%s/swift/v1' % (args.rgw_host, args.rgw_port)
-    src_srvclient = util.get_service_client(
-        tenant.name,
+    src_srvclient = _new_service_client(args, key, tokens)
+    if args.act != 'stat':
+        tgt_srvclient = _new_service_client(args, key, tokens)
+
+    return src_srvclient, tgt_srvclient
+
+
+def _new_service_client(args, key, tokens):
+    # Make sure the thread pools inside the service clients are not smaller
+    # than ours, otherwise our threads would just wait for theirs. A container
+    # thread is held by each listing in progress, so keep some more for
+    # container stats and creation. A connection is held by each download
+    # until its content is uploaded, up to --download-ranges for each
+    # object, so that all the transfers in flight can hold one.
+    threads = {
+        'container_threads': 10 + args.container_threads,
+        'object_dd_threads': max(10, args.object_threads),
+        'object_uu_threads': max(10, args.object_threads *
+                                 max(1, args.download_ranges)),
+    }
+
+    srvclient = util.get_service_client(
+        None,
         args.user.split(':')[1],
         key,
         args.authurl,
-        {'os_region_name': args.region, 'os_storage_url': storurl}
+        dict({'os_region_name': args.region}, **threads)
     )
 
-    if args.act == 'copy':
+    # Tokens rejected by RGW or Swift are renewed through the token cache.
+    return util.service_client_use_token_cache(srvclient, tokens)
+
+
+def _tee_endpoints(args):
+    """(host, port) of each --tee-host, the port is --port by default."""
+    endpoints = []
+    for host in args.tee_host:
+        host, _, port = host.partition(':')
+        endpoints.append((host, port or args.port))
+    return endpoints
+
+
+def _get_tee_clients(args, key, tokens):
+    """Get the service clients of the --tee-host targets."""
+    if args.act not in ('copy', 'retry'):
+        return []
+    return [_new_service_client(args, key, tokens)
+            for _ in _tee_endpoints(args)]
+
+
+def _switch_tenant(tenant, args, key, tokens, src_srvclient, tgt_srvclient):
+    """Point the service clients to tenant, return the service clients.
+
+    New service clients are created if jobs of the previous tenant are still
+    running in the current ones, e.g. a listing abandoned after an error.
+    """
+    if not all(util.is_idle(srvclient)
+               for srvclient in (src_srvclient, tgt_srvclient) if srvclient):
+        for srvclient in (src_srvclient, tgt_srvclient):
+            if srvclient:
+                util.retire_service_client(srvclient)
+        src_srvclient, tgt_srvclient = _get_service_clients(args, key,
+                                                            tokens)
+
+    # The same token is used for RGW and Swift, they share the same Keystone.
+    token = tokens.get(tenant.name)
+
+    storurl = 'https://%s:%s/swift/v1' % (args.rgw_host, args.rgw_port)
+    util.switch_service_client(src_srvclient, tenant.name, storurl, token)
+
+    if tgt_srvclient:
         storurl = 'https://%s:%s/v1/AUTH_%s' % (
             args.host, args.port, tenant.id)
-
-        tgt_srvclient = util.get_service_client(
-            tenant.name,
-            args.user.split(':')[1],
-            key,
-            args.authurl,
-            {'os_region_name': args.region, 'os_storage_url': storurl}
-        )
+        util.switch_service_client(tgt_srvclient, tenant.name, storurl, token)
 
     return src_srvclient, tgt_srvclient
 
 
-def worker(id, tenants, lock, stats, moved_stats, tenant_usage, args, key,
-           user, role, keyconn):
-    file_name = ("swift-migrate-worker-%02d.output" % id)
+def _switch_tee_clients(tenant, args, key, tokens, tee_srvclients):
+    """Point the service clients of the --tee-host targets to tenant."""
+    if not all(util.is_idle(srvclient) for srvclient in tee_srvclients):
+        for srvclient in tee_srvclients:
+            util.retire_service_client(srvclient)
+        tee_srvclients = _get_tee_clients(args, key, tokens)
+
+    token = tokens.get(tenant.name)
+    for (host, port), srvclient in zip(_tee_endpoints(args), tee_srvclients):
+        storurl = 'https://%s:%s/v1/AUTH_%s' % (host, port, tenant.id)
+        util.switch_service_client(srvclient, tenant.name, storurl, token)
+
+    return tee_srvclients
+
+
+def _get_tenant_sizes(tenants, args, key, user, role, keyconn, tokens):
+    """Get the (bytes, objects) of each tenant in RGW.
+
+    The sizes are only used to hand out the largest tenants first and to
+    estimate the progress before the tenants are started, so a tenant
+    whose account can not be checked here is simply put at the end of the
+    queue, the worker will report the error when processing it.
+
+    Return the sizes, and the names of the tenants whose access has been
+    checked, so that the workers do not check them again.
+    """
+    storurl = 'https://%s:%s/swift/v1' % (args.rgw_host, args.rgw_port)
+
+    # Each thread keeps its connection to RGW for all the tenants it checks.
+    local = threading.local()
+
+    def _get_size(tenant):
+        checked = False
+        try:
+            util.check_tenant_access(args, keyconn, user, tenant, role)
+            checked = True
+            token = tokens.get(tenant.name)
+
+            if not hasattr(local, 'conn'):
+                local.conn = util.use_token_cache(util.get_connection(
+                    tenant.name,
+                    args.user.split(':')[1],
+                    key,
+                    args.authurl,
+                    {'tenant_name': tenant.name, 'region_name': args.region,
+                     'object_storage_url': storurl},
+                    token=token
+                ), tokens)
+            else:
+                util.switch_connection(local.conn, tenant.name, storurl,
+                                       token)
+
+            account = local.conn.head_account()
+            return tenant.name, (int(account['x-account-bytes-used']),
+                                 int(account['x-account-object-count'])), True
+        except Exception:
+            return tenant.name, (0, 0), checked
+
+    pool = ThreadPool(SIZING_THREADS)
+    try:
+        results = pool.map(_get_size, tenants)
+    finally:
+        pool.close()
+
+    return (dict((name, size) for name, size, checked in results),
+            set(name for name, size, checked in results if checked))
+
+
+def worker(id, tenants, stats, args, key, user, role, keyconn, tokens,
+           metrics_queue=None, progress_queue=None, checked=(),
+           inventory_run=None):
+    file_name = ("swift-migrate-worker-%02d.jsonl" % id)
     max_size_info = {'tenant': '', 'container': '', 'object': '', 'size': 0}
 
-    # Remove the log file first.
-    if os.path.exists(file_name):
-        os.remove(file_name)
+    # The output is streamed to the log file (replacing the one of the last
+    # run), instead of being kept in memory until the tenant is done.
+    log = logwriter.LogWriter(file_name, max_bytes=args.log_max_bytes,
+                              backups=args.log_backups)
+
+    # The thread pools are shared by all the tenants of this worker.
+    container_pool = futures.ThreadPoolExecutor(args.container_threads)
+    object_pool = futures.ThreadPoolExecutor(args.object_threads)
+
+    # So is the limit of transfers in flight, it starts from half of the
+    # object threads when adaptive.
+    if args.adaptive_concurrency:
+        limiter = throttle.AIMDLimiter(max(1, args.object_threads // 2),
+                                       maximum=args.object_threads)
+    else:
+        limiter = throttle.AIMDLimiter(args.object_threads,
+                                       minimum=args.object_threads)
+
+    state = None
+    retry_queue = None
+    if args.act not in ('stat', 'plan'):
+        if args.state_db:
+            state = statedb.StateDB(args.state_db)
+        retry_queue = statedb.StateDB(args.retry_db)
+    elif (args.act == 'plan' and args.state_db and
+            os.path.exists(args.state_db)):
+        # Only read by the plan, which must not create any database.
+        state = statedb.StateDB(args.state_db)
+
+    # The metrics of a worker process are sent to the main process, which
+    # exports them.
+    reporter = None
+    if metrics_queue:
+        metrics.REGISTRY.reset()
+        reporter = metrics.Reporter(id, metrics_queue, args.metrics_interval)
+        reporter.start()
+
+    # With '--act stat', the listed objects can be dumped to the inventory,
+    # each worker in its own directory.
+    inventory_writer = None
+    if args.act == 'stat' and args.inventory:
+        inventory_writer = inventory.InventoryWriter(
+            os.path.join(args.inventory, '%02d' % id), run=inventory_run)
+
+    # The progress of the current tenant is reported to the main process.
+    tracker = progress.Tracker(id, progress_queue, args.progress_interval)
+
+    # The threads of the pooled metadata engine, with their connections, are
+    # shared by all the tenants of this worker.
+    metadata_pool = None
+    if args.metadata_engine == 'pooled':
+        metadata_pool = metadata.MetadataPool(args.metadata_concurrency,
+                                              tokens=tokens)
+
+    # The service clients, and their connections, are shared by all the
+    # tenants of this worker.
+    src_srvclient, tgt_srvclient = _get_service_clients(args, key, tokens)
+    tee_srvclients = _get_tee_clients(args, key, tokens)
 
     for tenant in tenants:
-        content = []
-        moved_stats[tenant.name] = {'moved_objects': 0, 'moved_bytes': 0}
+        content = log.bind(worker=id, tenant=tenant.name)
 
-        util.check_tenant_access(args, keyconn, user, tenant, role)
+        # The access may have been checked while sizing the tenants.
+        if tenant.name not in checked:
+            util.check_tenant_access(args, keyconn, user, tenant, role)
+        started = time.time()
 
         try:
             print('[%02d] processing tenant: %s' % (id, tenant.name))
             content.append("....processing tenant " + tenant.name)
 
-            src_srvclient, tgt_srvclient = _get_service_clients(
-                tenant, args, key)
-
-            with src_srvclient:
+            src_srvclient, tgt_srvclient = _switch_tenant(
+                tenant, args, key, tokens, src_srvclient, tgt_srvclient)
+            src_meta = metadata.get_engine(args.metadata_engine,
+                                           src_srvclient, metadata_pool)
+            tgt_meta = metadata.get_engine(args.metadata_engine,
+                                           tgt_srvclient, metadata_pool)
+            tee_srvclients = _switch_tee_clients(tenant, args, key, tokens,
+                                                 tee_srvclients)
+            tee_meta = [metadata.get_engine(args.metadata_engine, srvclient,
+                                            metadata_pool)
+                        for srvclient in tee_srvclients]
+
+            with metrics.timer('account_head'):
                 accout_stat = src_srvclient.stat()
-                account = accout_stat['headers']
+            account = accout_stat['headers']
 
-                content.append(
-                    "......containers: {0}, objects: {1}, bytes: {2}".format(
-                        account['x-account-container-count'],
-                        account['x-account-object-count'],
-                        account['x-account-bytes-used']
-                    )
-                )
-                tenant_usage[tenant.name] = int(
+            content.append(
+                "......containers: {0}, objects: {1}, bytes: {2}".format(
+                    account['x-account-container-count'],
+                    account['x-account-object-count'],
                     account['x-account-bytes-used']
                 )
-
-                if lock:
-                    with lock:
-                        stats['cons'] += int(
-                            account['x-account-container-count'])
-                        stats['objs'] += int(account['x-account-object-count'])
-                        stats['bytes'] += int(account['x-account-bytes-used'])
-                else:
-                    stats['cons'] += int(account['x-account-container-count'])
-                    stats['objs'] += int(account['x-account-object-count'])
-                    stats['bytes'] += int(account['x-account-bytes-used'])
-
-                if int(account['x-account-container-count']) > 0:
-                    if args.act == 'stat' and (args.verbose or args.object):
-                        stat_tenant(id, content, src_srvclient, max_size_info,
-                                    tenant.name, container=args.container,
-                                    object=args.object)
-                    if args.act == 'copy':
-                        with tgt_srvclient:
-                            migrate_tenant(
-                                id, content, src_srvclient, tgt_srvclient,
-                                container=args.container, object=args.object,
-                                moved_stats=moved_stats[tenant.name]
-                            )
+            )
+            stats.add(tenant.name,
+                      containers=int(account['x-account-container-count']),
+                      objects=int(account['x-account-object-count']),
+                      bytes=int(account['x-account-bytes-used']))
+            tracker.start_tenant(tenant.name,
+                                 int(account['x-account-object-count']),
+                                 int(account['x-account-bytes-used']))
+
+            if int(account['x-account-container-count']) > 0:
+                if args.act == 'stat' and (args.verbose or args.object or
+                                           args.stat_mode == 'sample' or
+                                           inventory_writer):
+                    # The inventory alone is built from the listings, the
+                    # objects are only stat'ed for -v or to be sampled.
+                    sample_rate = STAT_SAMPLE_RATES.get(args.stat_mode,
+                                                        args.sample_rate)
+                    if not args.verbose and args.stat_mode != 'sample':
+                        sample_rate = 0
+                    sample = sampling.Sample()
+                    stat_tenant(id, content, src_srvclient, max_size_info,
+                                tenant.name, container=args.container,
+                                object=args.object, sample_rate=sample_rate,
+                                sample=sample, verbose=args.verbose,
+                                inventory_writer=inventory_writer,
+                                engine=src_meta)
+                    if sample.counts['listed_objects']:
+                        for line in sample.report():
+                            content.append('......' + line)
+                        stats.add(tenant.name, **sample.counts)
+                if args.act != 'stat':
+                    ctx = _TenantContext(
+                        id, args, tenant, content, src_srvclient,
+                        tgt_srvclient, stats, container_pool, object_pool,
+                        state=state, limiter=limiter, retry_queue=retry_queue,
+                        tracker=tracker, src_meta=src_meta, tgt_meta=tgt_meta,
+                        tee_srvclients=tee_srvclients, tee_meta=tee_meta
+                    )
+                if args.act == 'plan':
+                    plan_tenant(ctx, container=args.container)
+                elif args.act == 'copy':
+                    migrate_tenant(ctx, container=args.container,
+                                   object=args.object)
+                elif args.act == 'retry':
+                    retry_tenant(ctx)
         except Exception as e:
             print(
                 '[%02d] error occured when processing tenant: %s. error: %s' %
@@ -835,14 +2742,31 @@ def worker(id, tenants, lock, stats, moved_stats, tenant_usage, args, key,
             traceback.print_exception(exc_type, exc_value, exc_traceback,
                                       limit=2, file=sys.stdout)
         finally:
-            with open(file_name, 'a') as file:
-                file.write('\n'.join(content))
-                file.write('\n')
+            tracker.finish_tenant()
+            metrics.observe('tenant', time.time() - started)
+
+    container_pool.shutdown()
+    object_pool.shutdown()
+    if metadata_pool:
+        metadata_pool.shutdown()
+    for srvclient in [src_srvclient, tgt_srvclient] + tee_srvclients:
+        if srvclient:
+            srvclient.thread_manager.__exit__(None, None, None)
+    if state:
+        state.close()
+    if retry_queue:
+        retry_queue.close()
+    if reporter:
+        reporter.stop()
+    tracker.stop()
+
+    if inventory_writer:
+        inventory_writer.close()
 
     # Print max object information.
     if args.act == 'stat' and args.verbose:
-        with open(file_name, 'a') as file:
-            file.write('\nmax object size info: %s' % max_size_info)
+        log.write('max object size info: %s' % max_size_info, worker=id)
+    log.close()
 
 
 def main():
@@ -857,52 +2781,117 @@ def main():
         user_name, tenant_name, key, True, 2, args.authurl,
     )
     user, role = util.get_user_role(args, keyconn, user_name, args.role)
-    tenants_group = util.get_tenant_group(args, keyconn, multiprocess=True)
+    tenants = util.get_tenants(args, keyconn)
 
-    if (args.container and
-            (len(tenants_group) != 1 or len(tenants_group[0]) != 1)):
+    if args.container and len(tenants) != 1:
         print('Error: Only one tenant can be specifed when specifying '
               'container to migrate.')
         sys.exit(1)
     if args.object and not args.container:
         print('Error: Container must be specified together with object.')
         sys.exit(1)
+    if args.resume and not args.state_db:
+        print('Error: State database must be specified to resume.')
+        sys.exit(1)
+
+    if args.act == 'retry':
+        # Only the tenants with objects in the retry queue are processed.
+        retry_queue = statedb.StateDB(args.retry_db)
+        retry_tenants = retry_queue.get_retry_tenants()
+        retry_queue.close()
+        tenants = [t for t in tenants if t.id in retry_tenants]
+
+    workers = max(min(args.concurrency, len(tenants)), 1)
+
+    # Each tenant is authenticated once per token lifetime, the tokens are
+    # inherited by the worker processes and shared through the cache file.
+    def _auth(name):
+        with metrics.timer('auth'):
+            return util.get_token(user_name, name, key, args.authurl)
+
+    tokens = tokencache.TokenCache(_auth, path=args.token_cache)
+
+    # Metrics of all the workers are written to the textfile periodically.
+    metrics_queue = None
+    exporter = None
+    if args.metrics_file:
+        metrics_queue = multiprocessing.Queue()
+        exporter = metrics.Exporter(args.metrics_file, metrics_queue,
+                                    args.metrics_interval)
+        exporter.start()
 
     print("\nStart migration in %s processes. The output of each process is "
           "contained in separated file under the script's directory.\n"
-          % len(tenants_group))
+          % workers)
 
-    stats = {'cons': 0, 'objs': 0, 'bytes': 0}
-    moved_stats = {}
-    tenant_usage = {}
+    # The counters of each tenant are updated by its worker in shared
+    # memory.
+    stats = util.TenantStats(tenants)
     elapsed = time.time()
 
-    if len(tenants_group) > 1:
-        jobs = []
-        lock = multiprocessing.Lock()
-        manager = multiprocessing.Manager()
-        stats = manager.dict({'cons': 0, 'objs': 0, 'bytes': 0})
-        moved_stats = manager.dict()
-        tenant_usage = manager.dict()
+    # The progress of all the workers is printed periodically.
+    progress_queue = None
+    monitor = None
+    if args.act in ('copy', 'retry') and args.progress_interval > 0:
+        progress_queue = multiprocessing.Queue()
+
+    # The inventory of this run replaces the one of an earlier run in the
+    # same directory.
+    inventory_run = None
+    if args.act == 'stat' and args.inventory:
+        inventory_run = inventory.start_run(args.inventory)
+
+    # The tenants are sized up front to be dispatched to the workers, and
+    # for the overall progress to cover the tenants not started yet.
+    sizes = {}
+    checked = ()
+    if workers > 1 or progress_queue:
+        sizes, checked = _get_tenant_sizes(tenants, args, key, user, role,
+                                           keyconn, tokens)
+
+    if progress_queue:
+        monitor = progress.Monitor(
+            progress_queue, args.progress_interval,
+            [t.name for t in tenants],
+            dict((name, (size[1], size[0]))
+                 for name, size in sizes.items()))
+        monitor.start()
+
+    if workers > 1:
+        # Workers pull tenants from a shared queue, largest tenant first.
+        tenant_queue = util.TenantQueue(
+            tenants, dict((name, size[0]) for name, size in sizes.items()),
+            workers)
 
-        for i in range(len(tenants_group)):
+        jobs = []
+        for i in range(workers):
             p = multiprocessing.Process(
                 target=worker,
-                args=(i, tenants_group[i], lock, stats, moved_stats,
-                      tenant_usage, args, key, user, role, keyconn)
+                args=(i, tenant_queue, stats, args, key, user, role,
+                      keyconn, tokens, metrics_queue, progress_queue, checked,
+                      inventory_run)
             )
             jobs.append(p)
             p.start()
         for p in jobs:
             p.join()
     else:
+        # The worker records its metrics in the registry of this process.
         worker(
-            0, tenants_group[0], None, stats, moved_stats, tenant_usage,
-            args, key, user, role, keyconn
+            0, tenants, stats, args, key, user, role, keyconn, tokens,
+            progress_queue=progress_queue, checked=checked,
+            inventory_run=inventory_run
         )
 
+    if exporter:
+        exporter.stop()
+    if monitor:
+        monitor.stop()
+
     elapsed = time.time() - elapsed
-    print_info(elapsed, stats, tenant_usage, moved_stats)
+    print_info(elapsed, stats)
+    if args.act == 'plan':
+        print_plan(stats, args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Fan out one stream of chunks to several consumers at the same time.
+
+An object is read once from RGW and uploaded to several Swift endpoints.
+Each consumer (an upload) runs in its own thread and gets the chunks from
+its own bounded queue, so it is at most BUFFER_CHUNKS chunks behind the
+source: the source is read at the pace of the slowest consumer, and the
+memory used stays bounded. A consumer which fails is dropped, the others go
+on.
+"""
+
+import sys
+
+from concurrent import futures
+import six
+from six.moves import queue
+
+# Chunks buffered for each consumer.
+BUFFER_CHUNKS = 16
+
+# Seconds to wait for room in the queue of a consumer before checking
+# whether it is still running.
+PUT_INTERVAL = 1
+
+
+class _SourceError(object):
+    """Tell the consumers that reading the chunks failed."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _queue_chunks(chunks):
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, _SourceError):
+            raise Exception('Reading the source failed: %s' % chunk.error)
+        yield chunk
+
+
+def _put(chunks, job, chunk):
+    """Put chunk in the queue, unless the consumer has finished."""
+    while not job.done():
+        try:
+            chunks.put(chunk, timeout=PUT_INTERVAL)
+            return
+        except queue.Full:
+            pass
+
+
+def _call(consumer, chunks):
+    """Call consumer in the current thread, return its future."""
+    job = futures.Future()
+    try:
+        job.set_result(consumer(iter(chunks)))
+    except Exception:
+        job.set_exception_info(*sys.exc_info()[1:])
+    return job
+
+
+def fan_out(chunks, consumers, buffer_chunks=BUFFER_CHUNKS):
+    """Feed the chunks to each consumer, reading them only once.
+
+    Each consumer is called with an iterator of the chunks, in its own
+    thread, and the futures of the consumers are returned in order once they
+    have all finished. A single consumer is called in the current thread.
+    If reading the chunks fails, the consumers are stopped and the error is
+    raised.
+    """
+    if len(consumers) == 1:
+        return [_call(consumers[0], chunks)]
+
+    queues = [queue.Queue(buffer_chunks) for consumer in consumers]
+    pool = futures.ThreadPoolExecutor(len(consumers))
+    try:
+        jobs = [pool.submit(consumer, _queue_chunks(q))
+                for consumer, q in zip(consumers, queues)]
+        try:
+            for chunk in chunks:
+                for q, job in zip(queues, jobs):
+                    _put(q, job, chunk)
+        except Exception:
+            exc_info = sys.exc_info()
+            for q, job in zip(queues, jobs):
+                _put(q, job, _SourceError(exc_info[1]))
+            futures.wait(jobs)
+            six.reraise(*exc_info)
+
+        for q, job in zip(queues, jobs):
+            _put(q, job, None)
+        futures.wait(jobs)
+        return jobs
+    finally:
+        pool.shutdown()
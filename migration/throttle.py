@@ -0,0 +1,175 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import socket
+import threading
+
+from requests import exceptions as requests_exceptions
+from swiftclient import ClientException
+
+# Responses telling that the cluster is overloaded or rate limiting us.
+OVERLOAD_STATUS = (408, 429, 498, 503, 504)
+
+# A transfer of MB_UNIT bytes weighs as much as one more request when
+# comparing latencies of objects of different sizes.
+MB_UNIT = 1024 * 1024
+
+
+def is_overload_error(exc):
+    """Whether the error means the cluster is overloaded.
+
+    The errors returned by swiftclient are often wrapped in another
+    exception, so the wrapped ones are checked as well.
+    """
+    while isinstance(exc, Exception):
+        if isinstance(exc, ClientException):
+            return exc.http_status in OVERLOAD_STATUS
+        if isinstance(exc, (socket.timeout, requests_exceptions.Timeout)):
+            return True
+
+        exc = exc.args[0] if exc.args else None
+
+    return False
+
+
+def is_transient_error(exc):
+    """Whether the request failing with the error is worth retrying.
+
+    Besides overload, server errors and broken connections are transient.
+    """
+    while isinstance(exc, Exception):
+        if isinstance(exc, ClientException):
+            return (exc.http_status in OVERLOAD_STATUS or
+                    (exc.http_status or 0) >= 500)
+        if isinstance(exc, (socket.error, requests_exceptions.Timeout,
+                            requests_exceptions.ConnectionError)):
+            return True
+
+        exc = exc.args[0] if exc.args else None
+
+    return False
+
+
+def is_not_found_error(exc):
+    """Whether the request failed because the object does not exist."""
+    while isinstance(exc, Exception):
+        if isinstance(exc, ClientException):
+            return exc.http_status == 404
+
+        exc = exc.args[0] if exc.args else None
+
+    return False
+
+
+def backoff_delay(attempt, base, cap=60):
+    """Delay before retry number 'attempt' (from 0), with full jitter.
+
+    The delay is picked at random up to base * 2 ** attempt, so that the
+    objects which failed at the same time are not retried at the same time.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AIMDLimiter(object):
+    """Limit of the transfers in flight, adapted to the health of clusters.
+
+    The limit is raised by one for each window of successful transfers (a
+    window being as many transfers as the limit), and cut by 'backoff' when a
+    transfer fails because of overload, or when the latency gets more than
+    'tolerance' times the best latency seen recently. It is cut at most once
+    per window, since all the transfers in flight see the same congestion.
+
+    Latency is measured per request and MB_UNIT transferred, so that objects
+    of different sizes can be compared. With minimum equal to maximum the
+    limit is fixed.
+    """
+
+    def __init__(self, limit, minimum=1, maximum=None, backoff=0.5,
+                 tolerance=2.0, smoothing=0.2, drift=0.01):
+        self.maximum = maximum or limit
+        self.minimum = min(minimum, self.maximum)
+        self.limit = float(max(self.minimum, min(limit, self.maximum)))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.drift = drift
+
+        self.in_flight = 0
+        self.latency = None
+        self.baseline = None
+        self.since_decrease = 0
+        self.cond = threading.Condition()
+
+    @property
+    def level(self):
+        return int(self.limit)
+
+    def acquire(self, blocking=True):
+        """Wait until one more transfer is allowed.
+
+        Without blocking, return whether the transfer is allowed now.
+        """
+        with self.cond:
+            while self.in_flight >= self.level:
+                if not blocking:
+                    return False
+                self.cond.wait()
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def observe(self, elapsed, bytes=0, overloaded=False):
+        """Adapt the limit to a finished transfer.
+
+        Return a message if the level has changed, None otherwise.
+        """
+        cost = elapsed / (1 + float(bytes) / MB_UNIT)
+
+        with self.cond:
+            level = self.level
+            self.since_decrease += 1
+
+            if self.latency is None:
+                self.latency = self.baseline = cost
+            else:
+                self.latency += self.smoothing * (cost - self.latency)
+                # The baseline follows the best latency, but slowly drifts up
+                # so that a lasting change of the clusters is accepted.
+                self.baseline = min(self.latency,
+                                    self.baseline * (1 + self.drift))
+
+            if overloaded:
+                reason = 'overload'
+            elif self.latency > self.tolerance * self.baseline:
+                reason = 'latency'
+            else:
+                reason = None
+
+            if reason and self.since_decrease >= level:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.since_decrease = 0
+            elif not reason:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+            self.cond.notify_all()
+
+            if self.level != level:
+                return 'concurrency %s -> %s (%s)' % (
+                    level, self.level, reason or 'healthy')
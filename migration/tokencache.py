@@ -0,0 +1,132 @@
+# Copyright 2016 Catalyst IT Ltd
+# Author: lingxian.kong@catalyst.net.nz
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+class TokenCache(object):
+    """Keystone tokens of tenants, reused until they are about to expire.
+
+    auth_fn(tenant_name) authenticates to the tenant and returns a tuple of
+    (token, expires), 'expires' being a unix timestamp. A token is given out
+    as long as it is valid for more than 'margin' seconds.
+
+    If path is given, the tokens are also kept in that file, so that they are
+    shared by the worker processes and by later runs. The file is locked
+    while it is read or written, not while authenticating.
+    """
+
+    def __init__(self, auth_fn, path=None, margin=300):
+        self.auth_fn = auth_fn
+        self.path = path
+        self.margin = margin
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.tenant_locks = collections.defaultdict(threading.Lock)
+
+    def _valid(self, entry):
+        return entry and entry[1] - self.margin > time.time()
+
+    def _load_or_auth(self, tenant_name, rejected=None):
+        with self._file_lock():
+            entry = self._read().get(tenant_name)
+        if self._valid(entry) and entry[0] != rejected:
+            return tuple(entry)
+
+        # The file is not locked while authenticating, so that the other
+        # tenants are not held up by this one.
+        entry = tuple(self.auth_fn(tenant_name))
+
+        with self._file_lock():
+            # Read the file again, the other processes may have added tokens
+            # meanwhile, or even one of this tenant which lasts longer.
+            entries = self._read()
+            other = entries.get(tenant_name)
+            if (self._valid(other) and other[0] != rejected and
+                    other[1] > entry[1]):
+                return tuple(other)
+            entries[tenant_name] = entry
+
+            # Forget the tokens which are expired anyway.
+            now = time.time()
+            entries = dict((k, v) for k, v in entries.items() if v[1] > now)
+
+            tmp_path = '%s.%s' % (self.path, os.getpid())
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmp_path, self.path)
+
+        return entry
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _file_lock(self):
+        return _FileLock(self.path + '.lock')
+
+    def get(self, tenant_name, rejected=None):
+        """Get a valid token of tenant, authenticate only if needed.
+
+        If the token 'rejected' has been rejected by the storage, it is not
+        given out again: the token obtained by another thread or process
+        since then is given out, or a new token is obtained and kept in the
+        file.
+        """
+        with self.lock:
+            tenant_lock = self.tenant_locks[tenant_name]
+
+        # Only one thread authenticates to a tenant at a time, the others
+        # wait for its token.
+        with tenant_lock:
+            entry = self.tokens.get(tenant_name)
+
+            if not self._valid(entry) or entry[0] == rejected:
+                if self.path:
+                    entry = self._load_or_auth(tenant_name, rejected)
+                else:
+                    entry = tuple(self.auth_fn(tenant_name))
+
+            self.tokens[tenant_name] = entry
+
+        return entry[0]
+
+
+class _FileLock(object):
+    """An exclusive lock on a file, held between worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
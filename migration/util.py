@@ -13,19 +13,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import math
+import calendar
+import ctypes
+import multiprocessing
+import threading
 
 from keystoneclient.v2_0 import client as k_client
+from six.moves.urllib.parse import urlparse
 import swiftclient
 from swiftclient.service import SwiftService
 
 
-def _chunks(arr, m):
-    """Split the arr into M chunks."""
-    n = int(math.ceil(len(arr) / float(m)))
-    return [arr[i:i + n] for i in range(0, len(arr), n)]
-
-
 def keystone_connect(user_name, tenant_name, key, insecure, auth_version,
                       auth_url, options={}):
     keycon = k_client.Client(
@@ -40,14 +38,18 @@ def keystone_connect(user_name, tenant_name, key, insecure, auth_version,
     return keycon
 
 
-def _get_tenants_group(tenants, args, multiprocess=False):
-    """Get tenants groups needed to be handled by multi-processes.
+def get_token(user_name, tenant_name, key, auth_url):
+    """Authenticate to tenant, return the token and its expiry timestamp."""
+    keycon = keystone_connect(user_name, tenant_name, key, True, 2, auth_url)
+    expires = calendar.timegm(keycon.auth_ref.expires.utctimetuple())
+
+    return keycon.auth_token, expires
 
-    Example1, we have 5 tenants [1, 2, 3, 4, 5], with concurrency 2, the
-    result groups will be: [[1, 2, 3], [4, 5]]
 
-    Example2, we have 5 tenants [1, 2, 3, 4, 5], with concurrency 3 or 4, the
-    result groups will be: [[1, 2], [3, 4], [5, 6]]
+def _filter_tenants(tenants, args):
+    """Get the tenants to handle, given the include/exclude options.
+
+    The tenants are spread over the worker processes by TenantQueue.
     """
     tenants_map = {}
     for t in tenants:
@@ -77,21 +79,96 @@ def _get_tenants_group(tenants, args, multiprocess=False):
             exclude_tnames = f.read().splitlines()
             actual_tnames = set(tenants_map.keys()) - set(exclude_tnames)
 
-    actual_tenants = [tenants_map[name] for name in actual_tnames]
+    return [tenants_map[name] for name in actual_tnames]
 
-    if multiprocess:
-        tenants_group = _chunks(actual_tenants, args.concurrency)
-    else:
-        tenants_group = [actual_tenants]
 
-    return tenants_group
+class TenantQueue(object):
+    """A work queue of tenants shared by worker processes.
 
+    Tenants are queued largest first and each worker pulls the next one as
+    soon as it becomes idle, so the elapsed time of the whole run follows the
+    biggest tenant instead of the unluckiest static chunk of tenants.
 
-def get_tenant_group(args, keyconn, multiprocess=False):
-    tenants = [t for t in keyconn.tenants.list() if t.enabled]
-    tenants_group = _get_tenants_group(tenants, args, multiprocess)
+    Only the tenant indexes go through the queue, the tenant objects are
+    inherited by the worker processes when they are forked.
+    """
+
+    def __init__(self, tenants, sizes, workers):
+        self.tenants = tenants
+        self.queue = multiprocessing.Queue()
+
+        order = sorted(
+            range(len(tenants)),
+            key=lambda i: sizes.get(tenants[i].name, 0),
+            reverse=True
+        )
+        for index in order:
+            self.queue.put(index)
+
+        # One sentinel for each worker, telling it there is nothing left.
+        for i in range(workers):
+            self.queue.put(None)
+
+    def __iter__(self):
+        for index in iter(self.queue.get, None):
+            yield self.tenants[index]
 
-    return tenants_group
+
+class TenantStats(object):
+    """Counters of each tenant, in memory shared by worker processes.
+
+    Each tenant has a slot of FIELDS counters in a shared array. A tenant is
+    processed by one worker only, so its slot has a single writer and is
+    updated without any lock between the processes, nor round trip to a
+    manager process. The threads of a worker still serialize their updates
+    of the slot. The counters are summed up when the workers are done.
+    """
+
+    FIELDS = ('containers', 'objects', 'bytes', 'moved_objects',
+              'moved_bytes',
+              # The counters of sampling.Sample, with '--act stat'.
+              'listed_objects', 'listed_multipart', 'sampled_objects',
+              'sampled_dlo', 'sampled_slo', 'sampled_meta_bytes',
+              'sampled_meta_bytes_sq') + tuple(
+        # The counters of '--act plan', by category of object.
+        'plan_%s_%s' % (category, unit)
+        for category in ('normal', 'multipart', 'dlo', 'large', 'existing',
+                         'failed')
+        for unit in ('objects', 'bytes'))
+
+    def __init__(self, tenants):
+        self.names = [t.name for t in tenants]
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.values = multiprocessing.RawArray(
+            ctypes.c_longlong, len(self.names) * len(self.FIELDS))
+
+    def _offset(self, tenant_name, field):
+        return (self.index[tenant_name] * len(self.FIELDS) +
+                self.FIELDS.index(field))
+
+    def add(self, tenant_name, **counts):
+        for field, value in counts.items():
+            self.values[self._offset(tenant_name, field)] += value
+
+    def get(self, tenant_name):
+        start = self.index[tenant_name] * len(self.FIELDS)
+        return dict(zip(self.FIELDS,
+                        self.values[start:start + len(self.FIELDS)]))
+
+    def items(self):
+        return [(name, self.get(name)) for name in self.names]
+
+    def totals(self):
+        totals = dict.fromkeys(self.FIELDS, 0)
+        for name, counts in self.items():
+            for field in self.FIELDS:
+                totals[field] += counts[field]
+        return totals
+
+
+def get_tenants(args, keyconn):
+    tenants = [t for t in keyconn.tenants.list() if t.enabled]
+    return _filter_tenants(tenants, args)
 
 
 def get_user_role(args, keyconn, username, rolename):
@@ -115,10 +192,15 @@ def check_tenant_access(args, keyconn, user, tenant, role):
         if r.name == 'admin' or r.name == args.role:
             break
     else:
-        keycon.roles.add_user_role(user, role, tenant)
+        keyconn.roles.add_user_role(user, role, tenant)
+
 
+def get_connection(tenant_name, user_name, key, auth_url, options={},
+                   token=None):
+    if token:
+        # Credentials are still given, to get a new token if it is rejected.
+        options = dict(options, auth_token=token)
 
-def get_connection(tenant_name, user_name, key, auth_url, options={}):
     return swiftclient.Connection(
         user=tenant_name + ':' + user_name,
         key=key,
@@ -129,7 +211,11 @@ def get_connection(tenant_name, user_name, key, auth_url, options={}):
     )
 
 
-def get_service_client(tenant_name, user_name, key, auth_url, options={}):
+def get_service_client(tenant_name, user_name, key, auth_url, options={},
+                       token=None):
+    if token:
+        options = dict(options, os_auth_token=token)
+
     return SwiftService(
         options=dict(
             {
@@ -145,6 +231,121 @@ def get_service_client(tenant_name, user_name, key, auth_url, options={}):
     )
 
 
+def switch_connection(conn, tenant_name, storage_url, token):
+    """Point a connection to another tenant, keeping its HTTP connection.
+
+    The HTTP connection (and the TLS session in it) is kept as long as the
+    new storage URL is on the same host, only the path of the account used
+    in the requests is changed.
+    """
+    conn.os_options.update(tenant_name=tenant_name,
+                           object_storage_url=storage_url,
+                           auth_token=token)
+    conn.url = storage_url
+    conn.token = token
+
+    if conn.http_conn:
+        parsed, http_conn = conn.http_conn
+        new_parsed = urlparse(storage_url)
+
+        if (parsed.scheme, parsed.netloc) == (new_parsed.scheme,
+                                              new_parsed.netloc):
+            conn.http_conn = (new_parsed, http_conn)
+        else:
+            conn.close()
+            conn.http_conn = None
+
+
+def use_token_cache(conn, tokens):
+    """Get the tokens of the connection from the token cache.
+
+    When a token is rejected, swiftclient authenticates again by itself. The
+    new token is got from the cache instead, so that it is shared by all the
+    connections and worker processes. The connection must have the storage
+    URL in its os_options.
+    """
+    def get_auth():
+        options = conn.os_options
+        token = tokens.get(options['tenant_name'],
+                           rejected=options.get('auth_token'))
+        options['auth_token'] = token
+        conn.url, conn.token = options['object_storage_url'], token
+        return conn.url, conn.token
+
+    conn.get_auth = get_auth
+    return conn
+
+
+def service_client_use_token_cache(srv_client, tokens):
+    """Get the tokens of the connections of a service client from the cache.
+
+    See use_token_cache, the connections are created by the thread pools of
+    the service client when they are needed.
+    """
+    def _wrap(create_connection):
+        return lambda: use_token_cache(create_connection(), tokens)
+
+    for pool in _connection_pools(srv_client):
+        pool._create_connection = _wrap(pool._create_connection)
+    return srv_client
+
+
+def _connection_pools(srv_client):
+    manager = srv_client.thread_manager
+    return (manager.segment_pool, manager.object_dd_pool,
+            manager.object_uu_pool, manager.container_pool)
+
+
+def is_idle(srv_client):
+    """Check no connection of the service client is being used by a job."""
+    return all(pool._connections.qsize() == pool._max_workers
+               for pool in _connection_pools(srv_client))
+
+
+def retire_service_client(srv_client):
+    """Shut down a service client once the jobs still running are done.
+
+    This is done in the background, the jobs may take a while.
+    """
+    thread = threading.Thread(target=srv_client.thread_manager.__exit__,
+                              args=(None, None, None))
+    thread.daemon = True
+    thread.start()
+
+
+def switch_service_client(srv_client, tenant_name, storage_url, token):
+    """Point a service client and its connections to another tenant.
+
+    This allows the connections to a storage host to be reused by all the
+    tenants, instead of creating a service client for each tenant. It must be
+    called when the service client is idle.
+    """
+    srv_client._options.update(os_tenant_name=tenant_name,
+                               os_storage_url=storage_url,
+                               os_auth_token=token)
+    srv_client._options['os_options'].update(tenant_name=tenant_name,
+                                             object_storage_url=storage_url,
+                                             auth_token=token)
+
+    for pool in _connection_pools(srv_client):
+        # The idle connections of the pool, None if not created yet.
+        for priority, conn in list(pool._connections.queue):
+            if conn is not None:
+                switch_connection(conn, tenant_name, storage_url, token)
+
+
+def call_with_connection(srv_client, fn, *args, **kwargs):
+    """Call fn with one of the connections of the service client.
+
+    Like the jobs run by the service client itself, the connection is passed
+    to fn as the first argument. This is for the requests which are not
+    supported by the service client.
+    """
+    future = srv_client.thread_manager.object_uu_pool.submit(fn, *args,
+                                                             **kwargs)
+    return future.result()
+
+
 def get_all_containers(srv_client):
     containers = []
 